@@ -1,4 +1,5 @@
 import argparse
+import os
 
 
 class ArgParser:
@@ -14,12 +15,105 @@ class ArgParser:
         self.arg_parser.add_argument(
             '--non-interactive', action='store_true',
             help='run the script in non-interactive mode')
+        self.arg_parser.add_argument(
+            '--prefetch', action='store_true',
+            help='download and unzip the packages without building them, '
+                 'then exit, can be run periodically to keep the workspace '
+                 'up to date')
         self.arg_parser.add_argument(
             '--skip-downloads', action='store_true',
             help='skip the download of the packages')
         self.arg_parser.add_argument(
             '--skip-tests', action='store_true',
             help='skip the tests')
+        self.arg_parser.add_argument(
+            '-j', '--jobs', type=int, default=os.cpu_count(),
+            help='maximum number of jobs run simultaneously by all the '
+                 'project builds together, the make processes share the '
+                 'budget through a jobserver',
+            metavar='N')
+        self.arg_parser.add_argument(
+            '--compiler-launcher', default='auto',
+            choices=['auto', 'ccache', 'sccache', 'none'],
+            help='compiler cache used by the builds, auto uses sccache or '
+                 'ccache if one of them is installed')
+        self.arg_parser.add_argument(
+            '--compiler-cache',
+            help='directory of the compiler cache',
+            metavar='PATH')
+        self.arg_parser.add_argument(
+            '--compiler-cache-size', type=int, default=5120,
+            help='maximum size of the compiler cache in MB',
+            metavar='MB')
+        self.arg_parser.add_argument(
+            '--download-jobs', type=int, default=8,
+            help='maximum number of packages downloaded simultaneously',
+            metavar='N')
+        self.arg_parser.add_argument(
+            '--download-jobs-per-host', type=int, default=6,
+            help='maximum number of packages downloaded simultaneously from '
+                 'the same host',
+            metavar='N')
+        self.arg_parser.add_argument(
+            '--download-cache',
+            help='directory of the download cache shared by all the '
+                 'workspaces on this machine',
+            metavar='PATH')
+        self.arg_parser.add_argument(
+            '--download-cache-size', type=int, default=2048,
+            help='maximum size of the download cache in MB',
+            metavar='MB')
+        self.arg_parser.add_argument(
+            '--no-download-cache', action='store_true',
+            help='do not use the download cache')
+        self.arg_parser.add_argument(
+            '--archive-format', choices=['zip', 'tar.gz'], default='zip',
+            help='format of the archives to download, tar.gz archives are '
+                 'extracted while they are being downloaded')
+        self.arg_parser.add_argument(
+            '--source-mode', choices=['archive', 'git'], default='archive',
+            help='download snapshots of the branches, or keep bare clones of '
+                 'the repositories and refresh them with git fetch which only '
+                 'transfers the new commits')
+        self.arg_parser.add_argument(
+            '--blake2b', action='store_true',
+            help='compute the BLAKE2b digest of the archives in addition to '
+                 'their SHA-256 digest and record it in the lockfile')
+        self.arg_parser.add_argument(
+            '--unzip-jobs', type=int, default=os.cpu_count(),
+            help='maximum number of threads used to unzip a package',
+            metavar='N')
+        self.arg_parser.add_argument(
+            '--mirror', action='append',
+            help='download the packages from a mirror directory or from an '
+                 'HTTP server serving a mirror directory, can be repeated in '
+                 'which case the fastest mirror is used and the others are '
+                 'used as fallbacks, https://github.com can be passed to use '
+                 'the original URLs as one of the mirrors',
+            metavar='PATH_OR_URL')
+        self.arg_parser.add_argument(
+            '--create-mirror-bundle',
+            help='download the packages, pack them in a mirror bundle and '
+                 'exit, the bundle can be unzipped to create a mirror '
+                 'directory',
+            metavar='PATH')
+        self.arg_parser.add_argument(
+            '--incremental-unzip', action='store_true',
+            help='only rewrite the source files that changed when a package '
+                 'is unzipped again so that they are not all rebuilt, only '
+                 'works for zip archives (not with --archive-format tar.gz '
+                 'or --source-mode git)')
+        self.arg_parser.add_argument(
+            '--lockfile', default='bootstrap.lock',
+            help='path of the lockfile that pins the downloaded archives',
+            metavar='PATH')
+        self.arg_parser.add_argument(
+            '--lockfile-mode',
+            choices=['generate', 'update', 'enforce', 'ignore'],
+            help='generate a new lockfile, update the existing lockfile, '
+                 'download the archives pinned by the lockfile, or ignore '
+                 'the lockfile (default: update if the lockfile exists, '
+                 'ignore otherwise)')
 
     def parse(self) -> argparse.Namespace:
         """Parse the command line.
@@ -12,13 +12,34 @@ from target import Target
 from dependencies import Dependencies
 from projects import Projects
 from cmake import CMake
-from compilers import Compilers
+from compilers import Compilers, Ninja
 from codesmithymake import CodeSmithyMake
 from build import BuildTools, BuildConfiguration 
 from utils import Utils
+from downloadcache import DownloadCache
+from zipextractor import ZipExtractor
+from lockfile import LockFile
+from mirror import Mirror, MirrorSelector
+from trash import Trash
+from workspacelock import WorkspaceLock
+from jobserver import Jobserver
+from compilerlauncher import CompilerLauncher
+from buildhistory import BuildHistory
+
+
+# Held by bootstrap builds and prefetches while they modify the workspace
+workspace_lock_path = ".bootstrap-workspace.lock"
+build_history_path = "build-durations.json"
+# Left by a prefetch for the next bootstrap build
+prefetch_marker_path = ".bootstrap-prefetched"
 
 
 def try_restore_previous_state(input, default, state):
+    if os.path.exists(prefetch_marker_path):
+        # Build/ holds the sources a prefetch just refreshed, they would be
+        # deleted if the previous execution wasn't resumed
+        default = "y"
+        os.remove(prefetch_marker_path)
     if state.previous_state_found:
         resume = input.query(
             "Previous execution detected. Do you want to resume it?",
@@ -28,18 +49,136 @@ def try_restore_previous_state(input, default, state):
             Utils.rmdir_with_retry("Build", input)
 
 
-def download_source_packages(projects, skip, input, state, output):
+def select_lockfile_mode(lockfile, mode, downloader):
+    if mode is None:
+        # The lockfile pins the branch archives, which change whenever
+        # something is pushed, so by default it only records what was
+        # downloaded
+        if lockfile.exists():
+            mode = "update"
+        else:
+            mode = "ignore"
+    if mode == "generate":
+        if lockfile.exists():
+            raise RuntimeError(lockfile.path + " already exists, use "
+                               "--lockfile-mode update to update it")
+    elif mode == "update":
+        if lockfile.exists():
+            lockfile.load()
+    elif mode == "enforce":
+        lockfile.load()
+        lockfile.pin(downloader)
+    return mode
+
+
+def download_source_packages(projects, skip, lockfile, lockfile_mode, state,
+                             output):
+    start_source_package_downloads(projects, skip, lockfile, lockfile_mode,
+                                   state, output)
+    projects.downloader.finish_download()
+
+
+def start_source_package_downloads(projects, skip, lockfile, lockfile_mode,
+                                   state, output):
+    """Starts the download step.
+
+    The packages are downloaded in the background while CMake is installed
+    and the projects are built, each of them as soon as its packages are
+    there. The lockfile is written and the step is recorded as soon as all
+    the packages are there, even if a build fails.
+    Downloader.finish_download waits for the downloads.
+    """
     print("")
     output.print_step_title("Downloading source packages")
+
+    def complete():
+        complete_source_package_downloads(projects, lockfile, lockfile_mode,
+                                          state)
+
     if skip:
         print("    Skipping downloads")
-    elif not state.download_complete:
-        Utils.rmdir_with_retry("Downloads", input)
-        projects.download()
+        complete()
     else:
-        print("    Using previous execution")
+        # The archives from previous executions are kept so they can be
+        # revalidated instead of being downloaded again. This is also done
+        # when a previous execution is resumed so that the projects whose
+        # packages changed since are built again.
+        if state.download_complete:
+            print("    Revalidating the packages of the previous execution")
+        projects.downloader.start_download(output, complete)
+    output.next_step()
+
+
+def complete_source_package_downloads(projects, lockfile, lockfile_mode,
+                                      state):
+    if lockfile_mode in ["generate", "update"]:
+        changed = lockfile.update(projects.downloader)
+        lockfile.save()
+        Output.print_line("    Lockfile " + lockfile.path + " written, " +
+                          str(len(changed)) + " change(s)")
+        for name in changed:
+            Output.print_line("        " + name)
+    elif lockfile_mode == "enforce":
+        Output.print_line("    Using archives pinned by " + lockfile.path)
     state.set_download_complete()
+
+
+def create_mirror_bundle(projects, path, output):
+    print("")
+    output.print_step_title("Creating mirror bundle")
+    Mirror.create_bundle(projects.downloader, path)
+    print("    Mirror bundle written to " + path)
+    output.next_step()
+
+
+def incremental_unzip_supported(args):
+    """Returns True if the packages can be updated in place when they are
+    unzipped again, which is only implemented for zip archives."""
+    return (args.archive_format == "zip") and (args.source_mode == "archive")
+
+
+def configure_downloader(downloader, args):
+    downloader.jobs = args.download_jobs
+    downloader.jobs_per_host = args.download_jobs_per_host
+    downloader.set_archive_format(args.archive_format)
+    downloader.set_source_mode(args.source_mode)
+    if args.blake2b:
+        downloader.set_digest_algorithms(["sha256", "blake2b"])
+    downloader.extractor = ZipExtractor(args.unzip_jobs)
+    downloader.incremental_unzip = args.incremental_unzip
+    if args.incremental_unzip and (not incremental_unzip_supported(args)):
+        print("    --incremental-unzip only works for zip archives, the "
+              "packages will be unzipped entirely")
+    if args.mirror is not None:
+        downloader.set_mirrors([Mirror(location) for location in args.mirror])
+        if len(args.mirror) > 1:
+            downloader.mirror_selector = MirrorSelector(
+                "Downloads/mirror-scores.json")
+    if not args.no_download_cache:
+        cache_path = args.download_cache
+        if cache_path is None:
+            cache_path = DownloadCache.default_path()
+        downloader.cache = DownloadCache(
+            cache_path, args.download_cache_size * 1024 * 1024)
+
+
+def select_compiler_launcher(args, output):
+    print("")
+    output.print_step_title("Compiler cache")
+    cache_dir = args.compiler_cache
+    if cache_dir is None:
+        cache_dir = CompilerLauncher.default_cache_dir()
+    launcher = CompilerLauncher.detect(
+        args.compiler_launcher, cache_dir,
+        args.compiler_cache_size * 1024 * 1024)
+    if launcher is None:
+        print("    No compiler cache")
+    else:
+        launcher.configure()
+        print("    Using " + launcher.executable + ", cache: " +
+              launcher.cache_dir)
     output.next_step()
+    return launcher
 
 
 def select_target(input, state, output):
@@ -69,6 +208,15 @@ def main_bootstrap_build(args, input, state, output):
         print("")
         output.print_main_title()
 
+        lock = WorkspaceLock(workspace_lock_path)
+        if not lock.acquire(False):
+            print("    Waiting for the prefetch in progress to finish",
+                  flush=True)
+            lock.acquire()
+
+        # Starts deleting what previous executions left in the trash
+        Trash.shared()
+
         try_restore_previous_state(input, "n", state)
     
         target = select_target(input, state, output)
@@ -79,12 +227,22 @@ def main_bootstrap_build(args, input, state, output):
         dependencies.check(output)
 
         projects = Projects(target)
+        configure_downloader(projects.downloader, args)
 
         projects.set_environment_variables(output)
 
-        download_source_packages(projects, args.skip_downloads, input, state,
-                                 output)
+        lockfile = LockFile(args.lockfile)
+        lockfile_mode = select_lockfile_mode(lockfile, args.lockfile_mode,
+                                             projects.downloader)
 
+        if args.create_mirror_bundle is not None:
+            download_source_packages(projects, args.skip_downloads, lockfile,
+                                     lockfile_mode, state, output)
+            create_mirror_bundle(projects, args.create_mirror_bundle, output)
+            return
+
+        # The questions are asked before the downloads start so that they
+        # are not mixed with the download progress
         compilers = Compilers(target)
         compiler = compilers.select_compiler(input, state, output)
 
@@ -92,15 +250,42 @@ def main_bootstrap_build(args, input, state, output):
         build_configuration.select_configuration(target.architecture,
                                                  compiler, input, state)
 
-        cmake = CMake(compiler.cmake_generator)
-        cmake.install(target, state, output)
+        jobserver = Jobserver(args.jobs)
+        compiler.jobserver = jobserver
 
-        codesmithymake = CodeSmithyMake(target.architecture)
+        launcher = select_compiler_launcher(args, output)
+        if launcher is not None:
+            compiler.launcher = launcher
+            build_configuration.cmake_generation_args.extend(
+                launcher.cmake_generation_args())
 
-        build_tools = BuildTools(cmake, compiler, codesmithymake)
-        
-        projects.build(build_tools, build_configuration,
-                       input, state, output)
+        start_source_package_downloads(projects, args.skip_downloads,
+                                       lockfile, lockfile_mode, state, output)
+        try:
+            ninja_executable = None
+            if isinstance(compiler, Ninja):
+                ninja_executable = compiler.ninja_executable
+            # Installed by projects.build, at the same time as the projects
+            # that don't need it are built
+            cmake = CMake(compiler.cmake_generator, jobserver, launcher,
+                          ninja_executable)
+
+            codesmithymake = CodeSmithyMake(target.architecture)
+
+            build_tools = BuildTools(cmake, compiler, codesmithymake,
+                                     jobserver)
+
+            try:
+                projects.build(build_tools, build_configuration,
+                               input, state, output, args.jobs,
+                               BuildHistory(build_history_path))
+            finally:
+                if launcher is not None:
+                    launcher.print_statistics()
+        except RuntimeError:
+            projects.downloader.cancel_download()
+            raise
+        projects.downloader.finish_download()
 
         print("")
         output.print_step_title("Running tests")
@@ -126,6 +311,54 @@ def main_bootstrap_build(args, input, state, output):
         sys.exit(-1)
 
 
+def main_prefetch(args, output):
+    """Downloads and unzips the packages without building anything.
+
+    The archives, the download cache and the unzipped sources in Build/ are
+    brought up to date so that the next bootstrap build doesn't have to wait
+    for the network. Nothing is done if a bootstrap build is in progress in
+    the workspace.
+    """
+    try:
+        print("")
+        output.print_main_title()
+
+        lock = WorkspaceLock(workspace_lock_path)
+        if not lock.acquire(False):
+            print("    A bootstrap build is in progress, nothing to prefetch")
+            return
+
+        Trash.shared()
+        Path("Build").mkdir(exist_ok=True)
+
+        # The packages only depend on the platform
+        projects = Projects(Target(platform.system(), "64"))
+        configure_downloader(projects.downloader, args)
+        if incremental_unzip_supported(args):
+            # The unchanged source files keep their timestamps so the next
+            # build doesn't rebuild them
+            projects.downloader.incremental_unzip = True
+        else:
+            print("    The packages can only be updated in place from zip "
+                  "archives, the next build will rebuild them entirely")
+
+        lockfile = LockFile(args.lockfile)
+        if args.lockfile_mode == "enforce":
+            lockfile.load()
+            lockfile.pin(projects.downloader)
+
+        print("")
+        output.print_step_title("Prefetching source packages")
+        projects.download(output)
+        projects.unzip()
+        Path(prefetch_marker_path).touch()
+        output.next_step()
+    except RuntimeError as error:
+        print("")
+        print("ERROR:", error)
+        sys.exit(-1)
+
+
 def main_launch_project(args, input, state, output):
     projects = Projects()
 
@@ -146,6 +379,10 @@ def main():
 
     input = Input(not args.non_interactive)
     output = Output()
+    if args.prefetch:
+        # The state belongs to the bootstrap builds and is left untouched
+        main_prefetch(args, output)
+        return
     state = State()
 
     if args.launch is None:
@@ -3,10 +3,12 @@ from compilers import VisualStudio
 class BuildTools:
     """Provides a way to group all the available build tools in one place."""
 
-    def __init__(self, cmake, compiler, codesmithymake):
+    def __init__(self, cmake, compiler, codesmithymake, jobserver=None):
         self.cmake = cmake
         self.compiler = compiler
         self.codesmithymake = codesmithymake
+        # The jobserver that limits the number of jobs run by all the builds
+        self.jobserver = jobserver
 
 
 class BuildConfiguration:
@@ -19,15 +21,18 @@ class BuildConfiguration:
             self.compiler_configuration = ""
             self.codesmithymake_configuration = ""
             self.architecture_dir_name = ""
+            self.architecture = ""
         else:
             self.cmake_configuration = build_configuration.cmake_configuration
             self.cmake_generation_args = build_configuration.cmake_generation_args.copy()
             self.compiler_configuration = build_configuration.compiler_configuration
             self.codesmithymake_configuration = build_configuration.codesmithymake_configuration
             self.architecture_dir_name = build_configuration.architecture_dir_name
+            self.architecture = build_configuration.architecture
 
     def select_configuration(self, architecture, compiler, input, state):
         compiler_configuration = self._select_compiler_configuration(compiler, input, state)
+        self.architecture = architecture
         self.cmake_configuration = compiler_configuration
         if isinstance(compiler, VisualStudio):
             self.compiler_configuration = compiler_configuration + "|"
@@ -0,0 +1,78 @@
+from typing import Optional
+import json
+import threading
+
+
+class BuildHistory:
+    """Durations of the project builds of previous executions.
+
+    The durations are kept as moving averages in a file that survives the
+    reset of the bootstrap state. They are used to start the projects on the
+    longest dependency chains first.
+    """
+
+    # Weight of the latest measurement in the moving averages
+    smoothing = 0.5
+    # The duration assumed for a project when no project has a recorded
+    # duration yet
+    default_duration = 60.0
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            The path of the file where the durations are saved.
+        """
+
+        self.path = path
+        self.durations = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r") as file:
+                self.durations = json.loads(file.read())
+        except (OSError, ValueError):
+            pass
+
+    def duration(self, name: str) -> Optional[float]:
+        """Returns the recorded duration of a project build in seconds, or
+        None if the project was never built."""
+        with self._lock:
+            return self.durations.get(name)
+
+    def estimate(self, name: str) -> float:
+        """Returns the expected duration of a project build in seconds.
+
+        Projects that were never built are assumed to take as long as the
+        average project.
+        """
+        with self._lock:
+            if name in self.durations:
+                return self.durations[name]
+            if len(self.durations) == 0:
+                return self.default_duration
+            return sum(self.durations.values()) / len(self.durations)
+
+    def record(self, name: str, duration: float):
+        """Records the duration of a project build.
+
+        Parameters
+        ----------
+        name : str
+            The name of the project.
+        duration : float
+            The wall-clock duration of the build in seconds.
+        """
+        with self._lock:
+            previous = self.durations.get(name)
+            if previous is None:
+                self.durations[name] = duration
+            else:
+                self.durations[name] = previous + \
+                    self.smoothing * (duration - previous)
+
+    def save(self):
+        with self._lock:
+            with open(self.path, "w") as file:
+                file.write(json.dumps(self.durations, indent=4,
+                                      sort_keys=True))
@@ -0,0 +1,230 @@
+from typing import Callable, Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor, wait, \
+    FIRST_COMPLETED
+import heapq
+
+
+class BuildScheduler:
+    """Runs tasks concurrently while respecting the dependencies between
+    them.
+
+    A task is started once all its dependencies have completed, and all
+    the futures it was given as prerequisites, for instance the downloads of
+    its packages, are done. Among the
+    tasks that are ready the ones with the highest priority are started
+    first, and then the ones that come first in the dependency graph.
+    """
+
+    def __init__(self, jobs: int = 1):
+        """
+        Parameters
+        ----------
+        jobs : int
+            The maximum number of tasks run at the same time.
+        """
+
+        self.jobs = max(1, jobs or 1)
+
+    @staticmethod
+    def check(dependencies: Dict[str, List[str]]):
+        """Checks that a dependency graph is acyclic and complete.
+
+        Parameters
+        ----------
+        dependencies : Dict[str, List[str]]
+            The names of the dependencies of each task.
+
+        Raises
+        ------
+        RuntimeError
+            If a task depends on a task that is not in the graph or if there
+            is a cycle in the graph.
+        """
+        for name, task_dependencies in dependencies.items():
+            for dependency in task_dependencies:
+                if dependency not in dependencies:
+                    raise RuntimeError(name + " depends on unknown project " +
+                                       dependency)
+        # Depth-first search, a task that is reached again while it is still
+        # on the stack closes a cycle
+        visited = set()
+        stack = []
+
+        def visit(name):
+            if name in stack:
+                cycle = stack[stack.index(name):] + [name]
+                raise RuntimeError("Dependency cycle: " + " -> ".join(cycle))
+            if name in visited:
+                return
+            stack.append(name)
+            for dependency in dependencies[name]:
+                visit(dependency)
+            stack.pop()
+            visited.add(name)
+
+        for name in dependencies:
+            visit(name)
+
+    @staticmethod
+    def critical_path_lengths(dependencies: Dict[str, List[str]],
+                              durations: Dict[str, float]) -> Dict[str, float]:
+        """Returns the duration of the longest chain of tasks that starts
+        with each task.
+
+        A task that starts a long chain delays everything after it, so using
+        these lengths as priorities starts the long chains first.
+
+        Parameters
+        ----------
+        dependencies : Dict[str, List[str]]
+            The names of the dependencies of each task.
+        durations : Dict[str, float]
+            The expected duration of each task.
+        """
+        dependents = BuildScheduler._dependents(dependencies)
+        lengths = {}
+
+        def length(name):
+            if name not in lengths:
+                lengths[name] = durations[name] + \
+                    max([length(dependent) for dependent in dependents[name]],
+                        default=0)
+            return lengths[name]
+
+        for name in dependencies:
+            length(name)
+        return lengths
+
+    def predict_makespan(self, dependencies: Dict[str, List[str]],
+                         durations: Dict[str, float],
+                         priorities: Optional[Dict[str, float]] = None
+                         ) -> float:
+        """Simulates run with the expected durations of the tasks.
+
+        Returns
+        -------
+        float
+            The time it should take to run all the tasks.
+        """
+        key = self._key(dependencies, priorities)
+        remaining = {name: set(task_dependencies)
+                     for name, task_dependencies in dependencies.items()}
+        dependents = BuildScheduler._dependents(dependencies)
+        ready = sorted((name for name in dependencies
+                        if len(remaining[name]) == 0), key=key)
+        running = []
+        time = 0
+        while (len(ready) != 0) or (len(running) != 0):
+            while (len(ready) != 0) and (len(running) < self.jobs):
+                name = ready.pop(0)
+                heapq.heappush(running, (time + durations[name], name))
+            time, name = heapq.heappop(running)
+            for dependent in dependents[name]:
+                remaining[dependent].discard(name)
+                if len(remaining[dependent]) == 0:
+                    ready.append(dependent)
+            ready.sort(key=key)
+        return time
+
+    def run(self, dependencies: Dict[str, List[str]],
+            run_task: Callable[[str], None],
+            on_start: Optional[Callable[[str], None]] = None,
+            on_complete: Optional[Callable[[str], None]] = None,
+            priorities: Optional[Dict[str, float]] = None,
+            prerequisites: Optional[Dict[str, List[Future]]] = None):
+        """Runs all the tasks of a dependency graph.
+
+        If a task fails no new task is started. The tasks already running
+        are completed and then the error of the first failed task is raised.
+
+        Parameters
+        ----------
+        dependencies : Dict[str, List[str]]
+            The names of the dependencies of each task.
+        run_task : Callable[[str], None]
+            Runs a task, it is called on a worker thread.
+        on_start : Callable[[str], None], optional
+            Called on the calling thread before a task is started.
+        on_complete : Callable[[str], None], optional
+            Called on the calling thread after a task has completed
+            successfully.
+        priorities : Dict[str, float], optional
+            The priority of each task, usually its critical path length.
+        prerequisites : Dict[str, List[Future]], optional
+            Futures that must be done before each task is started. They don't
+            need to have succeeded, the task is expected to check their
+            results.
+        """
+        BuildScheduler.check(dependencies)
+        key = self._key(dependencies, priorities)
+        remaining = {name: set(task_dependencies)
+                     for name, task_dependencies in dependencies.items()}
+        dependents = BuildScheduler._dependents(dependencies)
+        # The futures each task is waiting for, and the tasks waiting for
+        # each future
+        blocked = {name: set() for name in dependencies}
+        gates = {}
+        for name, futures in (prerequisites or {}).items():
+            for future in futures:
+                if not future.done():
+                    blocked[name].add(future)
+                    gates.setdefault(future, []).append(name)
+        ready = sorted((name for name in dependencies
+                        if (len(remaining[name]) == 0) and
+                        (len(blocked[name]) == 0)), key=key)
+        running = {}
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while (len(ready) != 0) or (len(running) != 0) or \
+                    (len(gates) != 0):
+                while (len(ready) != 0) and (len(running) < self.jobs) and \
+                        (len(errors) == 0):
+                    name = ready.pop(0)
+                    if on_start is not None:
+                        on_start(name)
+                    running[executor.submit(run_task, name)] = name
+                if (len(running) == 0) and \
+                        ((len(errors) != 0) or (len(gates) == 0)):
+                    break
+                done, pending = wait(set(running) | set(gates),
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in gates:
+                        for name in gates.pop(future):
+                            blocked[name].discard(future)
+                            if (len(remaining[name]) == 0) and \
+                                    (len(blocked[name]) == 0):
+                                ready.append(name)
+                    if future not in running:
+                        continue
+                    name = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as error:
+                        errors.append(error)
+                        continue
+                    if on_complete is not None:
+                        on_complete(name)
+                    for dependent in dependents[name]:
+                        remaining[dependent].discard(name)
+                        if (len(remaining[dependent]) == 0) and \
+                                (len(blocked[dependent]) == 0):
+                            ready.append(dependent)
+                ready.sort(key=key)
+        if len(errors) != 0:
+            raise errors[0]
+
+    @staticmethod
+    def _key(dependencies, priorities):
+        order = {name: i for i, name in enumerate(dependencies)}
+        if priorities is None:
+            return order.get
+        return lambda name: (-priorities.get(name, 0), order[name])
+
+    @staticmethod
+    def _dependents(dependencies):
+        dependents = {name: [] for name in dependencies}
+        for name, task_dependencies in dependencies.items():
+            for dependency in task_dependencies:
+                dependents[dependency].append(name)
+        return dependents
@@ -1,3 +1,5 @@
+from typing import Optional
+import json
 import os
 import zipfile
 import subprocess
@@ -5,49 +7,115 @@ import shutil
 from pathlib import Path
 from state import State
 from target import Target
-from compilers import GNUmake
+from compilers import GNUmake, Ninja
 from output import Output
-from download import Download
+from download import Download, Downloader
+from downloadcache import DownloadCache
 from build import BuildConfiguration
+from trash import Trash
 
 
 class CMake:
     """Wrapper used to invoke CMake."""
 
-    def __init__(self, generator):
+    # Records the arguments the build directories were generated with
+    generation_stamp_name = "bootstrap-generation.json"
+    # The generators that can write compile_commands.json
+    compile_commands_generators = ["Ninja", "Unix Makefiles"]
+
+    def __init__(self, generator, jobserver=None, launcher=None,
+                 ninja_executable=None):
         self.generator = generator
+        # The jobserver passed to the make processes started by CMake
+        self.jobserver = jobserver
+        # The compiler cache used to build CMake, the projects get it through
+        # their build configuration
+        self.launcher = launcher
+        # The ninja executable found by the selected toolchain, used by the
+        # Ninja generator
+        self.ninja_executable = ninja_executable
+
+    @staticmethod
+    def create_downloader(target: Target) -> Downloader:
+        """Creates a downloader to download the CMake source package.
 
-    def install(self, target: Target, state: State, output: Output):
+        The source package is only needed on the platforms where CMake is
+        built from source.
+
+        Parameters
+        ----------
+        target: Target
+            The target platform and architecture.
+
+        Returns
+        -------
+        Downloader
+            An instance of the Downloader class that can be used to download
+            the package.
+        """
+        downloader = Downloader()
+        if target.platform == "Linux":
+            download_url = "https://github.com/CodeSmithyIDE/CMake/archive/master.zip"
+            downloader.downloads.append(Download("CMake", download_url,
+                                                 "Build"))
+        return downloader
+
+    def install(self, target: Target, state: State, downloader: Downloader):
         """Installs CMake.
 
         CMake is not easily buildable on Windows so we rely on a binary
         distribution
 
+        The projects that don't need CMake can be built at the same time,
+        see Projects.build.
+
         Parameters
         ----------
         target: Target
             The target platform and architecture.
         state: State
             The state of the bootstrap build.
-        output: Output
-            The output helper.
+        downloader: Downloader
+            The downloader that was used to download the source packages.
         """
-        print("")
-        output.print_step_title("Installing CMake")
         if state.cmake_path == "":
-            self._install(target)
-            print("    CMake installed successfully")
+            self._install(target, downloader)
+            Output.print_line("    CMake installed successfully")
         else:
             self.path = state.cmake_path
-            print("    Using previous installation: " + self.path)
+            Output.print_line("    Using previous installation: " + self.path)
         state.set_cmake_path(self.path)
-        output.next_step()
+
+    @staticmethod
+    def build_dir(project_name: str,
+                  build_configuration: BuildConfiguration) -> str:
+        """Returns the directory where a project is built.
+
+        The build directories are outside the source trees so that they
+        survive the sources being unzipped again, there is one per project,
+        architecture and configuration.
+
+        Parameters
+        ----------
+        project_name : str
+            The name of the project.
+        build_configuration: BuildConfiguration
+            The build configuration.
+        """
+        configuration = build_configuration.cmake_configuration or "Default"
+        architecture = build_configuration.architecture or "Default"
+        return "Build/CMakeBuild/" + project_name + "/" + architecture + \
+            "-" + configuration
 
     def build(self, makefile_path: str,
               build_configuration: BuildConfiguration,
-              logfile: str):
+              logfile: str, build_dir: str,
+              project_name: Optional[str] = None):
         """Generate the makefiles and then use them to build the project.
 
+        The generation step is skipped if the build directory was generated
+        from the same CMakeLists.txt with the same arguments.
+
         Parameters
         ----------
         makefile_path : str
@@ -55,28 +123,97 @@ class CMake:
         build_configuration: BuildConfiguration
             The build configuration.
         logfile: str
-            The path to the file where the output of CMake will be written.
+            The name of the file in the build directory where the output of
+            CMake will be written.
+        build_dir: str
+            The directory where the project is built, see build_dir.
+        project_name: str, optional
+            The name of the project, the messages are prefixed with it.
         """
-        previous_working_dir = os.getcwd()
-        os.chdir(Path(makefile_path).parent)
+        prefix = "    "
+        if project_name is not None:
+            prefix += project_name + ": "
+        # The working directory is passed to the processes instead of being
+        # changed because several projects can be built at the same time
+        source_dir = Path(makefile_path).parent.resolve()
+        cmake_path = os.getcwd() + "/" + self.path
+        # The libraries and executables are still written to the source tree
+        # where the projects that depend on them expect them
+        generation_args = [cmake_path, "-G", self.generator, str(source_dir),
+                           "-DCMAKE_ARCHIVE_OUTPUT_DIRECTORY=" +
+                           str(source_dir),
+                           "-DCMAKE_LIBRARY_OUTPUT_DIRECTORY=" +
+                           str(source_dir),
+                           "-DCMAKE_RUNTIME_OUTPUT_DIRECTORY=" +
+                           str(source_dir)]
+        if (self.generator == "Ninja") and \
+                (self.ninja_executable is not None):
+            # The same ninja as the one the toolchain found
+            generation_args.append("-DCMAKE_MAKE_PROGRAM=" +
+                                   self.ninja_executable)
+        if self.generator in CMake.compile_commands_generators:
+            # For the editors and the tools that need the compiler flags
+            generation_args.append("-DCMAKE_EXPORT_COMPILE_COMMANDS=ON")
+        generation_args.extend(build_configuration.cmake_generation_args)
+        stamp = {"generator": self.generator,
+                 "generation_args": generation_args,
+                 "cmake_lists_sha256": DownloadCache.file_digest(
+                     makefile_path)}
+        stamp_path = Path(build_dir) / CMake.generation_stamp_name
+        previous_stamp = None
+        try:
+            with open(stamp_path, "r") as file:
+                previous_stamp = json.loads(file.read())
+        except (OSError, ValueError):
+            pass
+        if (previous_stamp is not None) and \
+                (previous_stamp.get("generator") != self.generator):
+            # CMake refuses to use a build directory with another generator
+            Trash.shared().remove(build_dir)
+            previous_stamp = None
+        Path(build_dir).mkdir(parents=True, exist_ok=True)
         try:
-            with open(logfile, "w") as output_file:
-                cmake_path = previous_working_dir + "/" + self.path
-                generation_args = [cmake_path, "-G", self.generator, "."]
-                generation_args.extend(build_configuration.cmake_generation_args)
-                print("    Executing " + " ".join(generation_args))
-                subprocess.check_call(generation_args, stdout=output_file)
+            with open(Path(build_dir) / logfile, "w") as output_file:
+                if (previous_stamp == stamp) and \
+                        (Path(build_dir) / "CMakeCache.txt").exists():
+                    Output.print_line(prefix + "Build directory " +
+                                      build_dir +
+                                      " is up to date, skipping generation")
+                else:
+                    # The stamp is only written back once the generation
+                    # succeeded
+                    stamp_path.unlink(missing_ok=True)
+                    Output.print_line(prefix + "Executing " +
+                                      " ".join(generation_args))
+                    subprocess.check_call(generation_args, stdout=output_file,
+                                          cwd=build_dir)
+                    with open(stamp_path, "w") as file:
+                        file.write(json.dumps(stamp))
                 build_args = [cmake_path, "--build", "."]
                 if build_configuration.cmake_configuration:
                     build_args.extend(["--config", build_configuration.cmake_configuration])
-                print("    Executing " + " ".join(build_args))
-                subprocess.check_call(build_args, stdout=output_file)
+                if self.generator == "Ninja":
+                    ninja = Ninja(self.ninja_executable)
+                    ninja.jobserver = self.jobserver
+                    with ninja.jobs() as (jobs, jobserver_args):
+                        if jobs is not None:
+                            build_args.extend(["--parallel", str(jobs)])
+                        Output.print_line(prefix + "Executing " +
+                                          " ".join(build_args))
+                        subprocess.check_call(build_args, stdout=output_file,
+                                              cwd=build_dir, **jobserver_args)
+                else:
+                    jobserver_args = {}
+                    if self.jobserver is not None:
+                        jobserver_args = self.jobserver.subprocess_args()
+                    Output.print_line(prefix + "Executing " +
+                                      " ".join(build_args))
+                    subprocess.check_call(build_args, stdout=output_file,
+                                          cwd=build_dir, **jobserver_args)
         except subprocess.CalledProcessError:
             raise RuntimeError("Compilation of " + makefile_path + " failed.")
-        finally:
-            os.chdir(previous_working_dir)
 
-    def _install(self, target):
+    def _install(self, target, downloader):
         self.path = ""
         if target.platform == "Windows":
             architecture_string = ""
@@ -94,24 +231,65 @@ class CMake:
             zip_ref.extractall("Build")
             zip_ref.close()
         elif target.platform == "Linux":
-            download_url = "https://github.com/CodeSmithyIDE/CMake/archive/master.zip"
-            download = Download("CMake", download_url, "Build")
-            download.download(None)
-            download.unzip()
-            previous_working_dir = os.getcwd()
-            os.chdir("Build/CMake")
+            # The source package is normally fetched with the other packages
+            # during the download step, which may still be in progress
+            downloader.wait_for_download("CMake")
+            download = downloader.get("CMake")
+            if not download.downloaded():
+                download.download(None, downloader.cache, downloader.session)
+            downloader.unzip("CMake")
+            # The working directory is left alone since the other packages
+            # are being downloaded to relative paths at the same time
+            working_dir = "Build/CMake"
+            try:
+                subprocess.check_call(["chmod", "0774", "bootstrap"],
+                                      cwd=working_dir)
+            except subprocess.CalledProcessError:
+                raise RuntimeError("chmod 0774 bootstrap failed.")
+            bootstrap_args = ["./bootstrap"]
+            use_ninja = (self.generator == "Ninja") and \
+                (self.ninja_executable is not None)
+            if use_ninja:
+                bootstrap_args.append("--generator=Ninja")
+            if self.launcher is not None:
+                # The arguments after -- are passed to CMake when it
+                # configures itself
+                bootstrap_args.append("--")
+                bootstrap_args.extend(
+                    self.launcher.cmake_generation_args())
             try:
-                try:
-                    subprocess.check_call(["chmod", "0774", "bootstrap"])
-                except subprocess.CalledProcessError:
-                    raise RuntimeError("chmod 0774 bootstrap failed.")
-                try:
-                    subprocess.check_call("./bootstrap")
-                except subprocess.CalledProcessError:
-                    raise RuntimeError("./bootstrap failed.")
-                GNUmake().compile("Makefile", None, None)
-                self.path = "Build/CMake/bin/cmake"
-            finally:
-                os.chdir(previous_working_dir)
+                if self.jobserver is None:
+                    subprocess.check_call(bootstrap_args, cwd=working_dir)
+                else:
+                    # Other projects are being built at the same time, the
+                    # make processes started by bootstrap take their jobs
+                    # from the jobserver instead of a --parallel budget of
+                    # their own
+                    with self.jobserver.token():
+                        subprocess.check_call(
+                            bootstrap_args, cwd=working_dir,
+                            **self.jobserver.subprocess_args())
+            except subprocess.CalledProcessError:
+                raise RuntimeError("./bootstrap failed.")
+            if use_ninja:
+                # The launcher was given to CMake when it configured itself
+                ninja = Ninja(self.ninja_executable)
+                ninja.jobserver = self.jobserver
+                if self.jobserver is None:
+                    ninja.build(working_dir)
+                else:
+                    with self.jobserver.token():
+                        ninja.build(working_dir)
+            else:
+                make = GNUmake()
+                make.jobserver = self.jobserver
+                make.launcher = self.launcher
+                makefile_path = working_dir + "/Makefile"
+                if self.jobserver is None:
+                    make.compile(makefile_path, None, None)
+                else:
+                    with self.jobserver.token():
+                        make.compile(makefile_path, None, None)
+            self.path = "Build/CMake/bin/cmake"
         else:
             raise RuntimeError("Unsupported platform: " + target.platform)
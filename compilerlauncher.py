@@ -0,0 +1,152 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+import json
+import os
+import shutil
+import subprocess
+
+
+class CompilerLauncher:
+    """Compiler cache, ccache or sccache, that the compilations go through.
+
+    CMake projects use the launcher through CMAKE_C_COMPILER_LAUNCHER and
+    CMAKE_CXX_COMPILER_LAUNCHER. For makefiles CC and CXX are wrapped in the
+    environment of make.
+
+    The cache directory and its size limit are passed to the launcher through
+    its environment variables, which are set in the environment of the
+    bootstrap so that all the builds and the sccache server inherit them.
+    """
+
+    supported_launchers = ["ccache", "sccache"]
+
+    def __init__(self, name: str, executable: str, cache_dir: str,
+                 max_size: int):
+        """
+        Parameters
+        ----------
+        name : str
+            Either "ccache" or "sccache".
+        executable : str
+            The path of the launcher.
+        cache_dir : str
+            The directory of the cache.
+        max_size : int
+            The maximum size of the cache in bytes.
+        """
+
+        self.name = name
+        self.executable = executable
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._initial_statistics = None
+
+    @staticmethod
+    def detect(preference: str, cache_dir: str,
+               max_size: int) -> Optional["CompilerLauncher"]:
+        """Finds a compiler launcher.
+
+        Parameters
+        ----------
+        preference : str
+            "auto" to use sccache or ccache, whichever is found first, the
+            name of the launcher to use, or "none".
+        cache_dir : str
+            The directory of the cache.
+        max_size : int
+            The maximum size of the cache in bytes.
+
+        Returns
+        -------
+        CompilerLauncher, optional
+            The launcher, or None if there is none to use.
+        """
+        if preference == "none":
+            return None
+        if preference == "auto":
+            names = CompilerLauncher.supported_launchers
+        else:
+            names = [preference]
+        for name in names:
+            executable = shutil.which(name)
+            if executable is not None:
+                return CompilerLauncher(name, executable, cache_dir,
+                                        max_size)
+        if preference != "auto":
+            raise RuntimeError(preference + " not found")
+        return None
+
+    @staticmethod
+    def default_cache_dir() -> str:
+        """Returns the location of the compiler cache.
+
+        The CODESMITHY_COMPILER_CACHE environment variable can be used to
+        override the default location.
+        """
+        if "CODESMITHY_COMPILER_CACHE" in os.environ:
+            return os.environ["CODESMITHY_COMPILER_CACHE"]
+        return str(Path.home() / ".codesmithy" / "compiler-cache")
+
+    def configure(self):
+        """Sets the cache location and size in the environment and records
+        the statistics of the cache to report the hits and misses of this
+        execution."""
+        Path(self.cache_dir).mkdir(parents=True, exist_ok=True)
+        size = str(max(1, self.max_size // (1024 * 1024))) + "M"
+        if self.name == "ccache":
+            os.environ["CCACHE_DIR"] = self.cache_dir
+            os.environ["CCACHE_MAXSIZE"] = size
+        else:
+            os.environ["SCCACHE_DIR"] = self.cache_dir
+            os.environ["SCCACHE_CACHE_SIZE"] = size
+        self._initial_statistics = self._statistics()
+
+    def cmake_generation_args(self) -> List[str]:
+        return ["-DCMAKE_C_COMPILER_LAUNCHER=" + self.executable,
+                "-DCMAKE_CXX_COMPILER_LAUNCHER=" + self.executable]
+
+    def make_environment(self, env: Dict[str, str]) -> Dict[str, str]:
+        """Returns a copy of an environment where CC and CXX go through the
+        launcher."""
+        env = dict(env)
+        env["CC"] = self.executable + " " + env.get("CC", "cc")
+        env["CXX"] = self.executable + " " + env.get("CXX", "c++")
+        return env
+
+    def print_statistics(self):
+        statistics = self._statistics()
+        if (statistics is None) or (self._initial_statistics is None):
+            print("    Compiler cache (" + self.name + "): no statistics")
+            return
+        hits = statistics[0] - self._initial_statistics[0]
+        misses = statistics[1] - self._initial_statistics[1]
+        print("    Compiler cache (" + self.name + ") " + self.cache_dir +
+              ": " + str(hits) + " hit(s), " + str(misses) + " miss(es)")
+
+    def _statistics(self):
+        # The statistics are cumulative, the hits and misses of this
+        # execution are the difference between two readings
+        try:
+            if self.name == "ccache":
+                result = subprocess.run([self.executable, "--print-stats"],
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL,
+                                        check=True)
+                counters = {}
+                for line in result.stdout.decode("utf-8").splitlines():
+                    fields = line.split("\t")
+                    if (len(fields) == 2) and fields[1].isdigit():
+                        counters[fields[0]] = int(fields[1])
+                return (counters.get("direct_cache_hit", 0) +
+                        counters.get("preprocessed_cache_hit", 0),
+                        counters.get("cache_miss", 0))
+            result = subprocess.run([self.executable, "--show-stats",
+                                     "--stats-format=json"],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, check=True)
+            stats = json.loads(result.stdout.decode("utf-8"))["stats"]
+            return (sum(stats["cache_hits"]["counts"].values()),
+                    sum(stats["cache_misses"]["counts"].values()))
+        except (OSError, subprocess.CalledProcessError, ValueError,
+                KeyError):
+            return None
@@ -1,14 +1,55 @@
+from contextlib import contextmanager
+from typing import Optional
+import json
 import os
+import re
+import shlex
+import shutil
 import subprocess
 
 
 class Compiler:
+    # The jobserver shared by the builds, if any
+    jobserver = None
+    # The compiler cache the compilations go through, if any
+    launcher = None
+    # The environment variables that change the output of the builds
+    environment_variables = ["CC", "CXX", "CPPFLAGS", "CFLAGS", "CXXFLAGS",
+                             "LDFLAGS", "INCLUDE", "LIB", "LIBPATH"]
+
     def __init__(self, name, short_name, executable, cmake_generator):
         self.name = name
         self.short_name = short_name
         self.executable = executable
         self.cmake_generator = cmake_generator
 
+    def identity(self) -> dict:
+        """Returns what identifies the compiler and its configuration.
+
+        The projects built with a compiler of another identity are built
+        again, for instance after the compiler was updated.
+        """
+        return {"name": self.name,
+                "short_name": self.short_name,
+                "executable": self.executable,
+                "cmake_generator": self.cmake_generator,
+                "version": self.version(),
+                "environment": {name: os.environ.get(name)
+                                for name in Compiler.environment_variables}}
+
+    def version(self) -> Optional[str]:
+        """Returns the version of the compiler, or None if it is unknown.
+
+        The size and modification time of the executable are used, they
+        change when the compiler is updated.
+        """
+        executable = shutil.which(self.executable) or self.executable
+        try:
+            stat = os.stat(executable)
+        except OSError:
+            return None
+        return str(stat.st_size) + " " + str(stat.st_mtime_ns)
+
     def compile(self, makefile_path, configuration, input):
         try:
             subprocess.check_call([self.executable, makefile_path,
@@ -18,18 +59,139 @@ class Compiler:
 
 
 class GNUmake(Compiler):
+    # The --version output of the C and C++ compilers, by command
+    _compiler_versions = {}
+
     def __init__(self):
         super().__init__("GNUmake", "GNUmakefile", "make", "Unix Makefiles")
 
+    def version(self) -> Optional[str]:
+        """Returns the --version output of the C and C++ compilers the
+        makefiles use, the ones of the CC and CXX environment variables or
+        cc and c++ by default."""
+        commands = (os.environ.get("CC", "cc"), os.environ.get("CXX", "c++"))
+        if commands not in GNUmake._compiler_versions:
+            versions = []
+            for command in commands:
+                try:
+                    versions.append(subprocess.check_output(
+                        shlex.split(command) + ["--version"],
+                        stderr=subprocess.STDOUT, universal_newlines=True))
+                except (OSError, subprocess.CalledProcessError):
+                    versions.append(None)
+            GNUmake._compiler_versions[commands] = versions
+        return json.dumps(GNUmake._compiler_versions[commands])
+
     def compile(self, makefile_path, configuration, input):
-        previous_working_dir = os.getcwd()
-        os.chdir(os.path.dirname(makefile_path))
+        subprocess_args = {}
+        if self.jobserver is not None:
+            subprocess_args = self.jobserver.subprocess_args()
+        if self.launcher is not None:
+            subprocess_args["env"] = self.launcher.make_environment(
+                subprocess_args.get("env", os.environ))
         try:
-            subprocess.check_call([self.executable, "--makefile=" + os.path.basename(makefile_path)])
+            subprocess.check_call([self.executable, "--makefile=" + os.path.basename(makefile_path)],
+                                  cwd=os.path.dirname(makefile_path) or None,
+                                  **subprocess_args)
         except subprocess.CalledProcessError:
             raise RuntimeError("Compilation of " + makefile_path + " failed.")
+
+
+class Ninja(GNUmake):
+    """GNU make for the makefiles and Ninja for the CMake projects.
+
+    Ninja checks that nothing needs to be rebuilt much faster than recursive
+    make, and schedules the jobs of a project across its directories.
+    Ninja 1.13 or later takes its jobs from the jobserver, but only if it is
+    given the path of its fifo. Older versions ignore the jobserver and are
+    given the tokens that are free when they start as a -j budget instead.
+    """
+
+    executable_names = ["ninja", "ninja-build"]
+    # The first version that is a jobserver client
+    jobserver_version = (1, 13)
+    # The versions of the ninja executables, by path
+    _versions = {}
+
+    def __init__(self, ninja_executable):
+        super().__init__()
+        self.name = "GNUmake + Ninja"
+        self.cmake_generator = "Ninja"
+        self.ninja_executable = ninja_executable
+
+    @staticmethod
+    def detect():
+        """Returns the path of the ninja executable, or None if Ninja is not
+        installed."""
+        for name in Ninja.executable_names:
+            executable = shutil.which(name)
+            if executable is not None:
+                return executable
+        return None
+
+    def ninja_version(self):
+        """Returns the version of the ninja executable as a tuple of
+        integers, or None if it is unknown."""
+        if self.ninja_executable not in Ninja._versions:
+            version = None
+            try:
+                output = subprocess.check_output(
+                    [self.ninja_executable, "--version"],
+                    universal_newlines=True)
+                match = re.match(r"(\d+)\.(\d+)", output.strip())
+                if match is not None:
+                    version = (int(match.group(1)), int(match.group(2)))
+            except (OSError, subprocess.CalledProcessError):
+                pass
+            Ninja._versions[self.ninja_executable] = version
+        return Ninja._versions[self.ninja_executable]
+
+    @contextmanager
+    def jobs(self):
+        """Gives Ninja its share of the jobserver for the duration of a with
+        statement.
+
+        The caller must hold a token of the jobserver, Ninja runs its first
+        job on it.
+
+        Yields
+        ------
+        (Optional[int], dict)
+            The number of jobs to pass with -j, or None if Ninja decides, and
+            the keyword arguments to pass to subprocess.
+        """
+        if self.jobserver is None:
+            yield None, {}
+            return
+        version = None
+        if self.ninja_executable is not None:
+            version = self.ninja_version()
+        if (version is not None) and (version >= Ninja.jobserver_version):
+            yield None, self.jobserver.subprocess_args(fifo=True)
+            return
+        tokens = []
+        while len(tokens) < self.jobserver.jobs - 1:
+            token = self.jobserver.try_acquire()
+            if token is None:
+                break
+            tokens.append(token)
+        try:
+            yield 1 + len(tokens), {}
         finally:
-            os.chdir(previous_working_dir)
+            for token in tokens:
+                self.jobserver.release(token)
+
+    def build(self, build_dir):
+        """Runs Ninja in a build directory generated by CMake."""
+        with self.jobs() as (jobs, subprocess_args):
+            args = [self.ninja_executable]
+            if jobs is not None:
+                args.extend(["-j", str(jobs)])
+            try:
+                subprocess.check_call(args, cwd=build_dir, **subprocess_args)
+            except subprocess.CalledProcessError:
+                raise RuntimeError("Compilation of " + build_dir +
+                                   " failed.")
 
 
 class VisualStudio(Compiler):
@@ -67,8 +229,12 @@ class Compilers:
         if foundMSVC14:
             self.compilers.append(VisualStudio("Visual Studio 2015", "VC14", "C:/Program Files (x86)/Microsoft Visual Studio 14.0/Common7/IDE/devenv.exe", self.architecture))
         if target.platform == "Linux":
+            # Ninja is preferred when it is installed
+            ninja_executable = Ninja.detect()
+            if ninja_executable is not None:
+                self.compilers.append(Ninja(ninja_executable))
             self.compilers.append(GNUmake())
-        
+
 
     def select_compiler(self, input, state, output):
         print("")
@@ -87,6 +253,9 @@ class Compilers:
             compiler = self.compilers[selected_compiler_index]
         else:
             compiler = self._find_by_name(state.selected_compiler)
+            if compiler is None:
+                raise RuntimeError("Previously selected compiler " +
+                                   state.selected_compiler + " not found")
             print("    Using previous selection: " + compiler.name)
         state.set_selected_compiler(compiler.name)
         output.next_step()
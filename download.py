@@ -1,57 +1,774 @@
+from typing import List
 from pathlib import Path
-import shutil
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import http.client
+import json
+import tarfile
+import threading
+import time
+import urllib.error
+import urllib.parse
 import os
+import re
 import zipfile
+import zlib
+from zipextractor import ZipExtractor
+from utils import Utils
+from unzipmanifest import UnzipManifest
+from httpsession import HTTPSession
+from gitrepository import GitRepository
+from output import Output
+from trash import Trash
 
 
 class Download:
+    # The size of the chunks the package is written to disk in
+    chunk_size = 1024 * 1024
+    # The number of attempts made before giving up on a download, the delay
+    # between attempts doubles after each failure
+    max_attempts = 5
+    retry_delay = 1
+    # The number of seconds without receiving any data after which a
+    # connection is considered dead
+    timeout = 60
+
     def __init__(self, name, url, extract_path, branch="master"):
         self.name = name
         self.url = url
         self.branch = branch
-
-        self.download_path = "Downloads/"
-        self.download_path += self.name + "-" + self.branch + ".zip"
+        self.archive_format = "zip"
+        self.source_mode = "archive"
+        self._update_paths()
+        # The URLs of mirrored copies of the package, used instead of url
+        self.mirror_urls = []
 
         self.extract_path_prefix = extract_path + "/"
 
+        # The digests computed while the archive is downloaded and saved
+        # with it
+        self.digest_algorithms = ["sha256"]
+
+        # The commit, size and digests of the archive if it is pinned by a
+        # lockfile
+        self.commit = None
+        self.size = None
+        self.sha256 = None
+        self.blake2b = None
+
         self.unzipped = False
+        self._unzip_lock = threading.Lock()
+
+    def set_archive_format(self, archive_format: str):
+        """Selects the format of the archive to download.
+
+        Parameters
+        ----------
+        archive_format : str
+            Either "zip" or "tar.gz". The contents of tar.gz archives are
+            extracted while they are being downloaded.
+        """
+        if archive_format not in ["zip", "tar.gz"]:
+            raise RuntimeError("Unsupported archive format: " + archive_format)
+        old_suffix = "." + self.archive_format
+        new_suffix = "." + archive_format
+        if self.url.endswith(old_suffix):
+            self.url = self.url[:-len(old_suffix)] + new_suffix
+        self.archive_format = archive_format
+        self._update_paths()
+
+    def set_source_mode(self, source_mode: str):
+        """Selects how the package is downloaded.
+
+        Parameters
+        ----------
+        source_mode : str
+            Either "archive" to download a snapshot of the branch, or "git" to
+            keep a bare clone of the repository in Downloads/ and refresh it
+            with git fetch. Only the new commits are transferred when a git
+            clone is refreshed.
+        """
+        if source_mode not in ["archive", "git"]:
+            raise RuntimeError("Unsupported source mode: " + source_mode)
+        self.source_mode = source_mode
+        self._update_paths()
+
+    def set_digest_algorithms(self, algorithms: List[str]):
+        """Selects the digests computed while the archive is downloaded.
+
+        Parameters
+        ----------
+        algorithms : List[str]
+            The hashlib names of the digests. "sha256" is always computed,
+            "blake2b" can be added.
+        """
+        self.digest_algorithms = ["sha256"] + \
+            [algorithm for algorithm in algorithms if algorithm != "sha256"]
+
+    def pin(self, commit, size, sha256, blake2b=None):
+        """Pins the archive to the values recorded in a lockfile.
+
+        The local copy is then used without contacting the server if it
+        matches, and a downloaded archive that doesn't match is rejected.
+
+        Parameters
+        ----------
+        commit
+            The commit the archive was generated from or None if unknown.
+        size
+            The size of the archive in bytes.
+        sha256
+            The SHA-256 digest of the archive.
+        blake2b
+            The BLAKE2b digest of the archive or None if it wasn't recorded.
+        """
+        self.commit = commit
+        self.size = size
+        self.sha256 = sha256
+        self.blake2b = blake2b
+        if (blake2b is not None) and \
+                ("blake2b" not in self.digest_algorithms):
+            self.digest_algorithms.append("blake2b")
+
+    def metadata(self):
+        """Returns the metadata saved with the downloaded archive.
+
+        Returns
+        -------
+        dict
+            The "url", "etag", "last_modified", "sha256", "size" and "commit"
+            of the archive, and its "blake2b" digest if it was computed, or
+            None if the archive hasn't been downloaded. In git mode the
+            "url", "commit" and "tree" of the checked out commit.
+        """
+        return self._load_metadata()
+
+    def downloaded(self) -> bool:
+        """Returns True if the package has been downloaded."""
+        if self.source_mode == "git":
+            return (self._load_metadata() is not None) and \
+                os.path.isdir(self.download_path)
+        return os.path.isfile(self.download_path)
+
+    def download(self, substep, cache=None, session=None, selector=None):
+        """Downloads the package.
+
+        If a previous copy of the package is available locally or in the
+        cache the request is made conditional on the ETag and Last-Modified
+        headers that were returned with it. The previous copy is reused if the
+        server replies that the package hasn't been modified.
+
+        The digests of the archive are computed while it is downloaded and
+        saved with it, so the archive is never read again to verify it.
+
+        If the package is pinned by a lockfile the local copy is used without
+        contacting the server when its saved digests match. The downloaded
+        archive must match the pinned digests.
+
+        Parameters
+        ----------
+        substep
+            The label of the download sub-step, for instance "6a", or None if
+            the download isn't part of the download step.
+        cache : DownloadCache, optional
+            The cache to serve the package from if it has a recent enough
+            copy. Packages that are downloaded are added to it.
+        session : HTTPSession, optional
+            The session used to send the requests. The shared session is used
+            if not specified.
+        selector : MirrorSelector, optional
+            The selector used to choose between the mirrors of the package.
+        """
 
-    def download(self, substep):
+        if self.source_mode == "git":
+            self._fetch_repository(substep)
+            return
+        if session is None:
+            session = HTTPSession.shared()
+        sources = self._sources(selector)
         if substep != None:
-            print("    Step 4" + substep + ": Fetching " + self.name +
-                  " code from " + self.url,
-                  flush=True)
+            Output.print_line("    Step " + substep + ": Fetching " +
+                              self.name + " code from " + sources[0])
         Path(self.download_path).parent.mkdir(parents=True, exist_ok=True)
-        urllib.request.urlretrieve(self.url, self.download_path)
+        metadata = self._load_metadata()
+        local_copy = (metadata is not None) and \
+            os.path.isfile(self.download_path)
+        if self.sha256 is not None:
+            if local_copy and self._matches_pin(metadata) and \
+                    (os.path.getsize(self.download_path) == self.size):
+                Output.print_line("    " + self.name + " matches the lockfile")
+                return
+            # The archives in the cache are stored by digest so the pinned
+            # archive can be served regardless of its age
+            if (cache is not None) and \
+                    cache.fetch_digest(self.sha256, self.download_path):
+                Trash.shared().remove(self.staging_path)
+                metadata = self._save_archive_metadata({"sha256": self.sha256})
+                self._check_pin(metadata)
+                return
+        elif (cache is not None) and \
+                cache.fetch(self.url, self.download_path):
+            Trash.shared().remove(self.staging_path)
+            cache_entry = cache.lookup(self.url) or {}
+            self._save_archive_metadata(dict(cache_entry,
+                                             sha256=cache_entry.get("digest")))
+            return
+
+        # Use the validators of the local copy if there is one, otherwise use
+        # the validators of the copy in the cache
+        validators = None
+        cache_entry = None
+        if local_copy:
+            validators = metadata
+        elif cache is not None:
+            cache_entry = cache.lookup(self.url)
+            validators = cache_entry
+
+        conditional_headers = {}
+        if validators is not None:
+            if validators.get("etag"):
+                conditional_headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = \
+                    validators["last_modified"]
+        try:
+            validators = self._fetch(conditional_headers, session, sources,
+                                     selector)
+        except urllib.error.HTTPError as error:
+            if (error.code != 304) or (validators is None):
+                raise
+            Output.print_line("    " + self.name +
+                              " not modified since last download")
+            if cache_entry is not None:
+                if not cache.revalidate(cache_entry["digest"],
+                                        self.download_path):
+                    raise RuntimeError(self.name + " was evicted from the "
+                                       "download cache")
+                validators = dict(cache_entry, sha256=cache_entry["digest"])
+        metadata = self._save_archive_metadata(validators)
+        self._check_pin(metadata)
+        if cache is not None:
+            cache.store(self.url, self.download_path, metadata["sha256"],
+                        validators)
 
-    def unzip(self, destination_dirs=None):
-        """Creates a downloader to download the package(s) for this project.
+    def unzip(self, destination_dirs=None, extractor=None, incremental=False):
+        """Unzips the package.
+
+        Projects that share a package can be built at the same time, the
+        package is unzipped by the first one and the others wait for it.
 
         Parameters
         ----------
         destination_dirs
             A list of directories where the package should be unzipped.
+        extractor : ZipExtractor, optional
+            The extractor used for zip archives.
+        incremental : bool
+            If True and the package was previously unzipped in the
+            directories, only the files that changed are written and the
+            files that are not in the package anymore are deleted. The other
+            files, including build outputs, are left untouched.
         """
 
-        if not self.unzipped:
-            print("    Unzipping " + self.download_path, flush=True)
-            if destination_dirs is None:
-                destination_dirs = [self.extract_path_prefix + self.name]
+        with self._unzip_lock:
+            self._unzip(destination_dirs, extractor, incremental)
+
+    def content_digest(self):
+        """Returns the digest that identifies the contents of the package.
+
+        Returns
+        -------
+        str
+            The SHA-256 digest of the archive, or the id of the tree of the
+            commit in git mode. None if the package hasn't been downloaded.
+        """
+        if (self.sha256 is not None) and (self.source_mode == "archive"):
+            return self.sha256
+        metadata = self._load_metadata()
+        if metadata is None:
+            return None
+        if self.source_mode == "git":
+            return metadata.get("tree")
+        return metadata.get("sha256")
+
+    def _unzip(self, destination_dirs, extractor, incremental):
+        if destination_dirs is None:
+            destination_dirs = [self.extract_path_prefix + self.name]
+        digest = self.content_digest()
+        if (not self.unzipped) and (digest is not None) and \
+                all(UnzipManifest.matches(destination_dir, digest)
+                    for destination_dir in destination_dirs):
+            Output.print_line("    " + self.download_path +
+                              " already unzipped and unchanged")
+        elif (not self.unzipped) and incremental and (digest is not None) and \
+                (self.source_mode == "archive") and \
+                (self.archive_format == "zip") and \
+                all(UnzipManifest.load(destination_dir) is not None
+                    for destination_dir in destination_dirs):
+            # Only rewrite the files that changed so the build tools don't
+            # rebuild everything
+            Output.print_line("    Updating from " + self.download_path)
+            if extractor is None:
+                extractor = ZipExtractor()
+            member_prefix = self.name + "-" + self.branch + "/"
+            for destination_dir in destination_dirs:
+                manifest = UnzipManifest.load(destination_dir)
+                crcs = extractor.update(self.download_path, member_prefix,
+                                        destination_dir, manifest.files)
+                UnzipManifest.create(destination_dir, digest, crcs)
+        elif not self.unzipped:
+            if incremental and \
+                    any(os.path.isdir(destination_dir)
+                        for destination_dir in destination_dirs):
+                if (self.source_mode != "archive") or \
+                        (self.archive_format != "zip"):
+                    reason = "only zip archives can be updated"
+                else:
+                    reason = "the previous unzip was not recorded"
+                Output.print_line("    " + self.download_path + ": " +
+                                  reason + ", replacing all the files")
+            Output.print_line("    Unzipping " + self.download_path)
+            # The archive is only extracted once, the other destinations are
+            # populated from the extracted tree
+            temp_destination_dir = self.extract_path_prefix + self.name + \
+                "-" + self.branch
+            staged_dir = self.staging_path + "/" + self.name + "-" + \
+                self.branch
             for destination_dir in destination_dirs:
-                temp_destination_dir = self.extract_path_prefix + self.name + "-" + self.branch
-                shutil.rmtree(destination_dir, ignore_errors=True)
-                shutil.rmtree(temp_destination_dir, ignore_errors=True)
-                zip_ref = zipfile.ZipFile(self.download_path, "r")
-                zip_ref.extractall(self.extract_path_prefix)
-                zip_ref.close()
-                os.rename(temp_destination_dir, destination_dir)
+                Trash.shared().remove(destination_dir)
+            crcs = None
+            if os.path.isdir(staged_dir):
+                # The tree was extracted during the download
+                extracted_dir = staged_dir
+            else:
+                extracted_dir = temp_destination_dir
+                Trash.shared().remove(temp_destination_dir)
+                if self.source_mode == "git":
+                    metadata = self._load_metadata()
+                    if metadata is None:
+                        raise RuntimeError(self.name + " hasn't been "
+                                           "downloaded")
+                    GitRepository(self.download_path).export(
+                        metadata["commit"], self.name + "-" + self.branch,
+                        self.extract_path_prefix)
+                elif self.archive_format == "tar.gz":
+                    with tarfile.open(self.download_path, "r:gz") as tar:
+                        Download._extract_tar(tar, self.extract_path_prefix)
+                else:
+                    if extractor is None:
+                        extractor = ZipExtractor()
+                    extractor.extract(self.download_path,
+                                      self.extract_path_prefix)
+                    crcs = ZipExtractor.member_crcs(
+                        self.download_path,
+                        self.name + "-" + self.branch + "/")
+            for destination_dir in destination_dirs:
+                Path(destination_dir).parent.mkdir(parents=True,
+                                                   exist_ok=True)
+            for destination_dir in destination_dirs[:-1]:
+                method = Utils.clone_tree(extracted_dir, destination_dir)
+                Output.print_line("    Populated " + destination_dir +
+                                  " (" + method + ")")
+            os.rename(extracted_dir, destination_dirs[-1])
+            Trash.shared().remove(self.staging_path)
+            if digest is not None:
+                for destination_dir in destination_dirs:
+                    UnzipManifest.create(destination_dir, digest, crcs)
         else:
-            print("    " + self.download_path + " already unzipped",
-                  flush=True)
+            Output.print_line("    " + self.download_path +
+                              " already unzipped")
         self.unzipped = True
 
+    def _fetch(self, conditional_headers, session, sources, selector):
+        """Streams the package to a .part file and renames it once complete.
+
+        Failed transfers are retried with an exponential backoff. When the
+        server supports it the transfer is resumed where it stopped with a
+        Range request. The If-Range header makes sure the package didn't
+        change in the meantime. A .part file left behind by a previous
+        execution is resumed the same way.
+
+        If there are several sources a failed transfer is retried on the
+        next source straight away. The throughput of the first chunk is
+        measured and the transfer moves to another source if the selector
+        knows a much faster one. Transfers are only resumed on the source
+        they were started on.
+
+        The contents of tar.gz archives are extracted to the staging
+        directory as the data arrives. If the transfer is interrupted the
+        partial tree is discarded and the archive is extracted from disk by
+        unzip once the download completes.
+
+        The digests of the archive are computed as the data arrives. When a
+        transfer is resumed only the part that was already received is read
+        back from disk.
+
+        Returns
+        -------
+        dict
+            The "etag" and "last_modified" validators of the package, and its
+            digests keyed by algorithm.
+        """
+        part_path = self.download_path + ".part"
+        part_metadata_path = part_path + ".json"
+        part_validators = self._load_metadata(part_metadata_path)
+        sources = list(sources)
+        source = sources[0]
+        switched = False
+        transferred = 0
+        start_time = time.monotonic()
+        attempt = 1
+        while True:
+            headers = dict(conditional_headers)
+            offset = 0
+            if_range = Download._if_range(part_validators)
+            if (if_range is not None) and os.path.isfile(part_path) and \
+                    (part_validators.get("source") == source):
+                offset = os.path.getsize(part_path)
+            if offset > 0:
+                headers["Range"] = "bytes=" + str(offset) + "-"
+                headers["If-Range"] = if_range
+            request_time = time.monotonic()
+            try:
+                with session.open(source, headers, self.timeout) as response:
+                    latency = time.monotonic() - request_time
+                    hashes = [hashlib.new(algorithm)
+                              for algorithm in self.digest_algorithms]
+                    if response.status == 206:
+                        mode = "ab"
+                        expected_size = Download._content_range_size(
+                            response.headers.get("Content-Range"))
+                        Download._hash_file(part_path, hashes)
+                    else:
+                        mode = "wb"
+                        expected_size = response.headers.get("Content-Length")
+                        if expected_size is not None:
+                            expected_size = int(expected_size)
+                        part_validators = {
+                            "etag": response.headers.get("ETag"),
+                            "last_modified":
+                                response.headers.get("Last-Modified"),
+                            "source": source}
+                        self._save_metadata(part_validators,
+                                            part_metadata_path)
+                    probe = None
+                    if (selector is not None) and (len(sources) > 1) and \
+                            not switched:
+                        def probe_throughput(size, elapsed):
+                            throughput = size / max(elapsed, 0.001)
+                            faster = self._faster_source(
+                                selector, source, throughput, sources)
+                            if faster is not None:
+                                selector.record(self._mirror_key(source),
+                                                latency, throughput)
+                                raise _SlowSource(faster, throughput)
+                        probe = probe_throughput
+                    # Whatever was extracted previously is out of date
+                    Trash.shared().remove(self.staging_path)
+                    with open(part_path, mode) as file:
+                        reader = _TeeReader(response, file, hashes,
+                                            self.chunk_size, probe)
+                        try:
+                            if (mode == "wb") and \
+                                    (self.archive_format == "tar.gz"):
+                                try:
+                                    with tarfile.open(fileobj=reader,
+                                                      mode="r|gz") as tar:
+                                        Download._extract_tar(
+                                            tar, self.staging_path)
+                                except (tarfile.TarError, EOFError,
+                                        zlib.error):
+                                    # Most likely the connection dropped,
+                                    # unzip will extract the archive from
+                                    # disk instead
+                                    Trash.shared().remove(self.staging_path)
+                            while reader.read(self.chunk_size):
+                                pass
+                        except BaseException:
+                            Trash.shared().remove(self.staging_path)
+                            raise
+                        finally:
+                            transferred += reader.transferred
+                        size = file.tell()
+                    if (expected_size is not None) and \
+                            (size != expected_size):
+                        raise http.client.IncompleteRead(
+                            b"", expected_size - size)
+                    if selector is not None:
+                        elapsed = max(time.monotonic() - request_time, 0.001)
+                        selector.record(self._mirror_key(source), latency,
+                                        reader.transferred / elapsed)
+                break
+            except _SlowSource as slow_source:
+                Output.print_line("    " + self.name + ": " + source +
+                                  " is slow (" + "{:.2f} MB/s".format(
+                                      slow_source.throughput / 1048576) +
+                                  "), switching to " + slow_source.source)
+                source = slow_source.source
+                switched = True
+                continue
+            except urllib.error.HTTPError as error:
+                if error.code == 304:
+                    # Not a failure of the source, the previous copy is
+                    # reused by download
+                    raise
+                if error.code == 416:
+                    # The .part file doesn't match the package anymore,
+                    # start again from scratch
+                    part_validators = None
+                elif (error.code < 500) and (error.code != 429):
+                    # This source doesn't have the package, try the others
+                    if len(sources) == 1:
+                        raise
+                    if selector is not None:
+                        selector.record_failure(self._mirror_key(source))
+                    Output.print_line("    " + self.name + ": " + source +
+                                      ": " + str(error))
+                    sources.remove(source)
+                    source = sources[0]
+                    continue
+                elif attempt >= self.max_attempts:
+                    raise
+                failure = error
+            except (urllib.error.URLError, http.client.HTTPException,
+                    ConnectionError, TimeoutError) as error:
+                if attempt >= self.max_attempts:
+                    raise
+                failure = error
+            if selector is not None:
+                selector.record_failure(self._mirror_key(source))
+            next_source = sources[(sources.index(source) + 1) % len(sources)]
+            if next_source != source:
+                Output.print_line("    " + self.name + ": " + source + ": " +
+                                  str(failure) + ", trying " + next_source)
+            if sources.index(next_source) == 0:
+                # Every source has failed, wait before trying again
+                delay = self.retry_delay * (2 ** (attempt - 1))
+                Output.print_line("    " + self.name + ": " + str(failure) +
+                                  ", retrying in " + str(delay) + "s")
+                time.sleep(delay)
+            source = next_source
+            attempt += 1
+        os.replace(part_path, self.download_path)
+        Path(part_metadata_path).unlink(missing_ok=True)
+        for hash in hashes:
+            part_validators[hash.name] = hash.hexdigest()
+        elapsed = max(time.monotonic() - start_time, 0.001)
+        Output.print_line("    " + self.name + ": " +
+                          "{:.1f} MB in {:.1f}s ({:.2f} MB/s)".format(
+                              transferred / 1048576, elapsed,
+                              transferred / 1048576 / elapsed))
+        return part_validators
+
+    def _fetch_repository(self, substep):
+        """Refreshes the bare clone of the repository.
+
+        If the package is pinned by a lockfile the pinned commit is used,
+        otherwise the tip of the branch.
+        """
+        sources = [Download._repository_url(url)
+                   for url in self._sources(None)]
+        if substep != None:
+            Output.print_line("    Step " + substep + ": Fetching " +
+                              self.name + " code from " + sources[0])
+        repository = GitRepository(self.download_path)
+        previous_size = repository.size() \
+            if os.path.isdir(self.download_path) else 0
+        for source in sources:
+            try:
+                commit = repository.fetch(source, self.branch)
+                if self.commit is not None:
+                    repository.fetch_commit(source, self.commit)
+                    commit = self.commit
+                break
+            except RuntimeError as error:
+                if source == sources[-1]:
+                    raise
+                Output.print_line("    " + self.name + ": " + str(error) +
+                                  ", trying " +
+                                  sources[sources.index(source) + 1])
+        tree = repository.resolve(commit + "^{tree}")
+        if tree is None:
+            raise RuntimeError(self.name + ": commit " + commit +
+                               " not found in " + sources[0])
+        metadata = self._load_metadata()
+        if (metadata is not None) and (metadata.get("commit") == commit):
+            Output.print_line("    " + self.name + " already at " + commit)
+        else:
+            Output.print_line("    " + self.name + ": " + commit + ", " +
+                              "{:.1f} KB fetched".format(
+                                  max(repository.size() - previous_size, 0) /
+                                  1024))
+        with open(self.metadata_path, "w") as file:
+            file.write(json.dumps({"url": self.url,
+                                   "commit": commit,
+                                   "tree": tree}))
+
+    @staticmethod
+    def _repository_url(url):
+        # https://github.com/owner/name/archive/master.zip becomes
+        # https://github.com/owner/name.git
+        match = re.match(r"(.*)/archive/[^/]+\.(zip|tar\.gz)$", url)
+        if match is None:
+            raise RuntimeError("Can't find the repository of " + url)
+        return match.group(1) + ".git"
+
+    def _sources(self, selector):
+        # The URLs to download the package from, in the order to try them
+        if len(self.mirror_urls) == 0:
+            return [self.url]
+        if selector is None:
+            return list(self.mirror_urls)
+        urls = {}
+        for url in self.mirror_urls:
+            urls[self._mirror_key(url)] = url
+        return [urls[mirror] for mirror in selector.rank(list(urls))]
+
+    def _mirror_key(self, source):
+        # The base URL of the mirror, which is the same for all packages
+        path = urllib.parse.urlsplit(self.url).path
+        if source.endswith(path):
+            return source[:-len(path)]
+        return source
+
+    def _faster_source(self, selector, source, throughput, sources):
+        urls = {}
+        for url in sources:
+            urls[self._mirror_key(url)] = url
+        faster = selector.faster(self._mirror_key(source), throughput,
+                                 list(urls))
+        if faster is None:
+            return None
+        return urls[faster]
+
+    @staticmethod
+    def _extract_tar(tar, path):
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(path, filter="data")
+        else:
+            tar.extractall(path)
+
+    @staticmethod
+    def _if_range(validators):
+        # If-Range requires a strong ETag or a date
+        if validators is None:
+            return None
+        etag = validators.get("etag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return validators.get("last_modified")
+
+    @staticmethod
+    def _content_range_size(content_range):
+        # The header looks like "bytes 100-199/200", the total may be "*"
+        if (content_range is None) or content_range.endswith("/*"):
+            return None
+        return int(content_range.rsplit("/", 1)[1])
+
+    def _update_paths(self):
+        if self.source_mode == "git":
+            # The bare clone of the repository
+            self.download_path = "Downloads/" + self.name + "-" + \
+                self.branch + ".git"
+        else:
+            self.download_path = "Downloads/" + self.name + "-" + \
+                self.branch + "." + self.archive_format
+        # The HTTP validators and the digest of the archive are stored next
+        # to it
+        self.metadata_path = self.download_path + ".json"
+        # Where tar.gz archives are extracted while they are being downloaded
+        self.staging_path = "Downloads/" + self.name + "-" + self.branch
+
+    def _archive_commit(self):
+        # GitHub stores the commit in the comment of the archives
+        try:
+            if self.archive_format == "tar.gz":
+                with tarfile.open(self.download_path, "r:gz") as tar:
+                    commit = tar.pax_headers.get("comment")
+            else:
+                with zipfile.ZipFile(self.download_path, "r") as zip_ref:
+                    commit = zip_ref.comment.decode("ascii")
+        except (OSError, EOFError, UnicodeDecodeError, tarfile.TarError,
+                zipfile.BadZipFile, zlib.error):
+            return None
+        if (commit is None) or \
+                (re.fullmatch("[0-9a-f]{40}", commit) is None):
+            return None
+        return commit
+
+    def _save_archive_metadata(self, validators):
+        # Only the digests that are not already known are computed
+        missing = [algorithm for algorithm in self.digest_algorithms
+                   if not validators.get(algorithm)]
+        hashes = [hashlib.new(algorithm) for algorithm in missing]
+        Download._hash_file(self.download_path, hashes)
+        metadata = {"url": self.url,
+                    "etag": validators.get("etag"),
+                    "last_modified": validators.get("last_modified"),
+                    "size": os.path.getsize(self.download_path),
+                    "commit": self._archive_commit()}
+        for algorithm in self.digest_algorithms:
+            metadata[algorithm] = validators.get(algorithm)
+        for hash in hashes:
+            metadata[hash.name] = hash.hexdigest()
+        with open(self.metadata_path, "w") as file:
+            file.write(json.dumps(metadata))
+        return metadata
+
+    def _matches_pin(self, metadata):
+        if metadata.get("sha256") != self.sha256:
+            return False
+        return (self.blake2b is None) or \
+            (metadata.get("blake2b") == self.blake2b)
+
+    def _check_pin(self, metadata):
+        if (self.sha256 is None) or self._matches_pin(metadata):
+            return
+        os.remove(self.download_path)
+        os.remove(self.metadata_path)
+        Trash.shared().remove(self.staging_path)
+        if metadata["sha256"] != self.sha256:
+            difference = "SHA-256 " + metadata["sha256"] + " instead of " + \
+                self.sha256
+        else:
+            difference = "BLAKE2b " + metadata["blake2b"] + " instead of " + \
+                self.blake2b
+        raise RuntimeError(self.name + " doesn't match the lockfile (" +
+                           difference + "), the branch has probably moved, "
+                           "use --lockfile-mode update to update the "
+                           "lockfile")
+
+    @staticmethod
+    def _hash_file(path, hashes):
+        if len(hashes) == 0:
+            return
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                for hash in hashes:
+                    hash.update(chunk)
+
+    def _load_metadata(self, metadata_path=None):
+        if metadata_path is None:
+            metadata_path = self.metadata_path
+        try:
+            with open(metadata_path, "r") as file:
+                metadata = json.loads(file.read())
+        except (OSError, ValueError):
+            return None
+        if metadata.get("url") != self.url:
+            return None
+        return metadata
+
+    def _save_metadata(self, validators, metadata_path=None):
+        if metadata_path is None:
+            metadata_path = self.metadata_path
+        metadata = {"url": self.url,
+                    "etag": validators.get("etag"),
+                    "last_modified": validators.get("last_modified"),
+                    "source": validators.get("source")}
+        with open(metadata_path, "w") as file:
+            file.write(json.dumps(metadata))
+
     def __eq__(self, other):
         if not isinstance(other, Download):
             return False
@@ -61,9 +778,73 @@ class Download:
                 (self.unzipped == other.unzipped))
 
 
+class _TeeReader:
+    """File-like object that writes the data read from a stream to a file and
+    feeds it to hashes.
+
+    If a probe is given it is called with the number of bytes read and the
+    elapsed time once probe_size bytes have been read.
+    """
+
+    def __init__(self, stream, file, hashes=(), probe_size=0, probe=None):
+        self.stream = stream
+        self.file = file
+        self.hashes = hashes
+        self.transferred = 0
+        self.probe_size = probe_size
+        self.probe = probe
+        self.start_time = time.monotonic()
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.file.write(data)
+        for hash in self.hashes:
+            hash.update(data)
+        self.transferred += len(data)
+        if (self.probe is not None) and \
+                (self.transferred >= self.probe_size):
+            probe = self.probe
+            self.probe = None
+            probe(self.transferred, time.monotonic() - self.start_time)
+        return data
+
+
+class _SlowSource(Exception):
+    """Raised to move a transfer to a faster source."""
+
+    def __init__(self, source, throughput):
+        super().__init__(source)
+        self.source = source
+        self.throughput = throughput
+
+
 class Downloader:
-    def __init__(self):
+    """Downloads a set of packages concurrently.
+
+    The number of simultaneous transfers is bounded by jobs and the number of
+    simultaneous transfers from the same host is bounded by jobs_per_host.
+
+    If a cache is set the packages are served from it when possible.
+    """
+
+    def __init__(self, jobs=8, jobs_per_host=6):
         self.downloads = []
+        self.jobs = jobs
+        self.jobs_per_host = jobs_per_host
+        self.cache = None
+        self.session = HTTPSession.shared()
+        self.extractor = ZipExtractor()
+        self.incremental_unzip = False
+        self.mirror_selector = None
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._errors = []
+        self._completion_error = None
+        # Set while no download is in progress
+        self._resolved = threading.Event()
+        self._resolved.set()
 
     def merge(self, other_downloader):
         for other_download in other_downloader.downloads:
@@ -79,11 +860,221 @@ class Downloader:
             if not already_present:
                 self.downloads.append(other_download)
 
-    def download(self):
-        for download, i in zip(self.downloads, range(ord("a"), ord("z"))):
-            download.download(chr(i))
+    def get(self, name):
+        for download in self.downloads:
+            if download.name == name:
+                return download
+        return None
+
+    def set_archive_format(self, archive_format):
+        for download in self.downloads:
+            download.set_archive_format(archive_format)
+
+    def set_digest_algorithms(self, algorithms):
+        for download in self.downloads:
+            download.set_digest_algorithms(algorithms)
+
+    def set_source_mode(self, source_mode):
+        for download in self.downloads:
+            download.set_source_mode(source_mode)
+
+    def set_mirrors(self, mirrors):
+        """Fetches all the packages from mirrors instead of their original
+        URL.
+
+        Parameters
+        ----------
+        mirrors : List[Mirror]
+            The mirrors. If there is more than one mirror a MirrorSelector
+            should be set to choose between them.
+        """
+        for download in self.downloads:
+            download.mirror_urls = [mirror.url(download.url)
+                                    for mirror in mirrors]
+
+    def download(self, output=None):
+        self.start_download(output)
+        self.finish_download()
+
+    def start_download(self, output=None, on_complete=None):
+        """Starts downloading the packages in the background.
+
+        wait_for_download waits for a package, so that it can be used while
+        the other packages are still being downloaded, and finish_download
+        waits for all of them.
+
+        Parameters
+        ----------
+        output : Output, optional
+            The output helper, the downloads are printed as sub-steps of its
+            current step.
+        on_complete : Callable[[], None], optional
+            Called on a download thread as soon as all the packages have been
+            downloaded successfully, whatever happens to the builds that use
+            them. An error it raises is raised by finish_download.
+        """
+        host_semaphores = {}
+        for download in self.downloads:
+            host = urllib.parse.urlparse(download.url).netloc
+            if host not in host_semaphores:
+                host_semaphores[host] = threading.BoundedSemaphore(
+                    max(1, self.jobs_per_host))
+
+        def download_with_host_limit(download, substep):
+            host = urllib.parse.urlparse(download.url).netloc
+            with host_semaphores[host]:
+                download.download(substep, self.cache, self.session,
+                                  self.mirror_selector)
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, self.jobs))
+        self._futures = {}
+        self._remaining = len(self.downloads)
+        self._errors = []
+        self._completion_error = None
+        self._resolved.clear()
+        step = ""
+        if output is not None:
+            step = str(output.current_step)
+        for i, download in enumerate(self.downloads):
+            self._futures[download.name] = self._executor.submit(
+                download_with_host_limit, download,
+                step + Downloader.substep_label(i))
+
+        def download_done(future):
+            with self._lock:
+                self._remaining -= 1
+                if self._remaining != 0:
+                    return
+            self._resolve(on_complete)
+
+        if len(self._futures) == 0:
+            self._resolve(on_complete)
+        # The callbacks are only added once all the futures are known
+        for future in list(self._futures.values()):
+            future.add_done_callback(download_done)
+
+    def download_future(self, name):
+        """Returns the future of a package started by start_download, or None
+        if the package isn't being downloaded."""
+        return self._futures.get(name)
+
+    def wait_for_download(self, name):
+        """Waits until a package started by start_download is downloaded.
+
+        Raises
+        ------
+        RuntimeError
+            If the package failed to download.
+        """
+        future = self._futures.get(name)
+        if future is None:
+            return
+        try:
+            future.result()
+        except Exception as error:
+            raise RuntimeError("Failed to download " + name + " (" +
+                               str(error) + ")")
+
+    def finish_download(self):
+        """Waits for all the packages started by start_download.
+
+        Raises
+        ------
+        RuntimeError
+            If one or more packages failed to download.
+        """
+        self._resolved.wait()
+        self._close_executor()
+        if len(self._errors) != 0:
+            raise RuntimeError("Failed to download " +
+                               ", ".join(self._errors))
+        if self._completion_error is not None:
+            raise self._completion_error
+
+    def cancel_download(self):
+        """Cancels the downloads started by start_download that haven't
+        started yet, and waits for the ones in progress."""
+        for future in self._futures.values():
+            future.cancel()
+        self._resolved.wait()
+        self._close_executor()
+
+    def _resolve(self, on_complete):
+        # Called once all the downloads are done, failed or cancelled
+        cancelled = False
+        for name, future in self._futures.items():
+            if future.cancelled():
+                cancelled = True
+            elif future.exception() is not None:
+                self._errors.append(name + " (" + str(future.exception()) +
+                                    ")")
+        if self.cache is not None:
+            self.cache.print_statistics()
+        if self.mirror_selector is not None:
+            self.mirror_selector.save()
+        if self.session.requests_sent != 0:
+            Output.print_line("    " + str(self.session.requests_sent) +
+                              " HTTP request(s) sent over " +
+                              str(self.session.connections_opened) +
+                              " connection(s)")
+        if (len(self._errors) == 0) and (not cancelled) and \
+                (on_complete is not None):
+            try:
+                on_complete()
+            except Exception as error:
+                self._completion_error = error
+        self._resolved.set()
+
+    def _close_executor(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._futures = {}
+
+    @staticmethod
+    def substep_label(index: int) -> str:
+        """Returns the label of a download sub-step.
+
+        The labels are "a" to "z", followed by "aa", "ab" and so on, so that
+        any number of downloads can be labelled.
+
+        Parameters
+        ----------
+        index : int
+            The zero-based index of the download.
+
+        Returns
+        -------
+        str
+            The label of the sub-step.
+        """
+        label = ""
+        index += 1
+        while index > 0:
+            index, remainder = divmod(index - 1, 26)
+            label = chr(ord("a") + remainder) + label
+        return label
 
     def unzip(self, name, destination_dirs=None):
         for download in self.downloads:
             if download.name == name:
-                download.unzip(destination_dirs)
+                download.unzip(destination_dirs, self.extractor,
+                               self.incremental_unzip)
+
+    def unzip_concurrently(self, packages):
+        """Unzips several independent packages at the same time.
+
+        Parameters
+        ----------
+        packages
+            A dictionary with the names of the packages as keys and the list
+            of directories where each package should be unzipped as values,
+            or None to use the default directory. The directories must be
+            different for each package.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, len(packages))) as \
+                executor:
+            futures = [executor.submit(self.unzip, name, destination_dirs)
+                       for name, destination_dirs in packages.items()]
+            for future in futures:
+                future.result()
@@ -0,0 +1,291 @@
+from typing import Optional
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from output import Output
+
+
+class DownloadCache:
+    """Machine-wide cache of downloaded packages.
+
+    The cache is shared by all the bootstrap workspaces on a machine. Archives
+    are stored under objects/ and named after the SHA-256 digest of their
+    content so identical archives are only stored once. The files under urls/
+    map a URL to the digest of the archive last downloaded from it.
+
+    Files are always written to a temporary name and then renamed so several
+    bootstrap builds can use the same cache at the same time.
+
+    When the total size of the archives exceeds max_size the least recently
+    used archives are evicted.
+    """
+
+    def __init__(self, path: str, max_size: int, max_age: int = 3600):
+        """
+        Parameters
+        ----------
+        path : str
+            The directory where the cache is stored.
+        max_size : int
+            The maximum size of the cache in bytes.
+        max_age : int
+            The number of seconds during which an archive can be served from
+            the cache without downloading it again. The URLs point to branch
+            snapshots that change over time so they can't be cached forever.
+        """
+
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        Path(self.path, "objects").mkdir(parents=True, exist_ok=True)
+        Path(self.path, "urls").mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def default_path() -> str:
+        """Returns the location of the cache.
+
+        The CODESMITHY_DOWNLOAD_CACHE environment variable can be used to
+        override the default location.
+        """
+        if "CODESMITHY_DOWNLOAD_CACHE" in os.environ:
+            return os.environ["CODESMITHY_DOWNLOAD_CACHE"]
+        return str(Path.home() / ".codesmithy" / "download-cache")
+
+    def lookup(self, url: str) -> Optional[dict]:
+        """Returns the cache entry for a URL.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the archive.
+
+        Returns
+        -------
+        dict, optional
+            The entry with the "url", "digest", "size" and "fetched" keys,
+            and the "etag", "last_modified" and "blake2b" keys if they are
+            known, or
+            None if the URL is not in the cache or its archive was evicted.
+        """
+        try:
+            with open(self._entry_path(url), "r") as file:
+                entry = json.loads(file.read())
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(self._object_path(entry["digest"])):
+            return None
+        return entry
+
+    def fetch(self, url: str, destination_path: str) -> bool:
+        """Copies the cached archive for a URL if it is recent enough.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the archive.
+        destination_path : str
+            The path where the archive will be copied.
+
+        Returns
+        -------
+        bool
+            True if the archive was served from the cache, False otherwise.
+        """
+        entry = self.lookup(url)
+        if (entry is not None) and \
+                (time.time() - entry["fetched"] < self.max_age):
+            if self.copy(entry["digest"], destination_path):
+                self._count(True)
+                return True
+        self._count(False)
+        return False
+
+    def fetch_digest(self, digest: str, destination_path: str) -> bool:
+        """Copies the cached archive with a given digest.
+
+        Unlike fetch the age of the archive doesn't matter as the digest
+        identifies the contents of the archive.
+
+        Parameters
+        ----------
+        digest : str
+            The SHA-256 digest of the archive.
+        destination_path : str
+            The path where the archive will be copied.
+
+        Returns
+        -------
+        bool
+            True if the archive was served from the cache, False otherwise.
+        """
+        hit = self.copy(digest, destination_path)
+        self._count(hit)
+        return hit
+
+    def revalidate(self, digest: str, destination_path: str) -> bool:
+        """Copies a cached archive the server confirmed is up to date.
+
+        The archive was too old to be served by fetch, which counted a miss.
+        It is counted as a hit instead since it was served from the cache.
+
+        Parameters
+        ----------
+        digest : str
+            The SHA-256 digest of the archive.
+        destination_path : str
+            The path where the archive will be copied.
+
+        Returns
+        -------
+        bool
+            True if the archive was copied, False if it is not in the cache.
+        """
+        if not self.copy(digest, destination_path):
+            return False
+        with self._lock:
+            self.hits += 1
+            self.misses -= 1
+        return True
+
+    def copy(self, digest: str, destination_path: str) -> bool:
+        """Copies an archive out of the cache.
+
+        Parameters
+        ----------
+        digest : str
+            The SHA-256 digest of the archive.
+        destination_path : str
+            The path where the archive will be copied.
+
+        Returns
+        -------
+        bool
+            True if the archive was copied, False if it is not in the cache.
+        """
+        object_path = self._object_path(digest)
+        temp_path = destination_path + "." + self._unique_suffix()
+        try:
+            shutil.copyfile(object_path, temp_path)
+            os.replace(temp_path, destination_path)
+        except OSError:
+            # The archive may have been evicted by another bootstrap build
+            # in the meantime
+            Path(temp_path).unlink(missing_ok=True)
+            return False
+        try:
+            os.utime(object_path)
+        except OSError:
+            pass
+        return True
+
+    def store(self, url: str, source_path: str,
+              digest: Optional[str] = None,
+              validators: Optional[dict] = None) -> str:
+        """Adds an archive to the cache.
+
+        Parameters
+        ----------
+        url : str
+            The URL the archive was downloaded from.
+        source_path : str
+            The path of the archive.
+        digest : str, optional
+            The SHA-256 digest of the archive. It is computed if not
+            provided.
+        validators : dict, optional
+            The "etag" and "last_modified" HTTP validators of the archive.
+            They are used to revalidate the archive once it is too old to be
+            served without checking with the server. The "blake2b" digest of
+            the archive is also recorded if present.
+
+        Returns
+        -------
+        str
+            The SHA-256 digest of the archive.
+        """
+        if digest is None:
+            digest = DownloadCache.file_digest(source_path)
+        object_path = self._object_path(digest)
+        if os.path.isfile(object_path):
+            os.utime(object_path)
+        else:
+            temp_path = object_path + "." + self._unique_suffix()
+            shutil.copyfile(source_path, temp_path)
+            os.replace(temp_path, object_path)
+        entry = {"url": url,
+                 "digest": digest,
+                 "size": os.path.getsize(object_path),
+                 "fetched": time.time()}
+        if validators is not None:
+            entry["etag"] = validators.get("etag")
+            entry["last_modified"] = validators.get("last_modified")
+            if validators.get("blake2b"):
+                entry["blake2b"] = validators["blake2b"]
+        entry_path = self._entry_path(url)
+        temp_path = entry_path + "." + self._unique_suffix()
+        with open(temp_path, "w") as file:
+            file.write(json.dumps(entry))
+        os.replace(temp_path, entry_path)
+        self.evict()
+        return digest
+
+    def evict(self):
+        """Removes the least recently used archives until the cache fits in
+        max_size."""
+        archives = []
+        total_size = 0
+        for entry in os.scandir(Path(self.path, "objects")):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            archives.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+        archives.sort()
+        for mtime, size, path in archives:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+            except OSError:
+                pass
+
+    def print_statistics(self):
+        Output.print_line("    Download cache " + self.path + ": " +
+                          str(self.hits) + " hit(s), " + str(self.misses) +
+                          " miss(es)")
+
+    @staticmethod
+    def file_digest(path: str) -> str:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _entry_path(self, url):
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return str(Path(self.path, "urls", name + ".json"))
+
+    def _object_path(self, digest):
+        return str(Path(self.path, "objects", digest))
+
+    def _unique_suffix(self):
+        return str(os.getpid()) + "-" + str(threading.get_ident()) + ".tmp"
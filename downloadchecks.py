@@ -0,0 +1,300 @@
+import argparse
+import contextlib
+import email.utils
+import hashlib
+import http.server
+import io
+import os
+import shutil
+import socket
+import subprocess
+import tarfile
+import tempfile
+import threading
+from download import Download, Downloader
+from mirror import Mirror, MirrorSelector
+
+
+class CheckRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the files of a directory the way GitHub serves the archives,
+    with an ETag and a Last-Modified date, conditional requests and range
+    requests.
+
+    The server can be told to cut the next transfer of a file halfway, or
+    to answer all the requests with an error status.
+    """
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        path = os.path.join(server.root, self.path.lstrip("/"))
+        if server.error_status is not None:
+            self._send_status(server.error_status)
+            return
+        if not os.path.isfile(path):
+            self._send_status(404)
+            return
+        with open(path, "rb") as file:
+            data = file.read()
+        etag = '"' + hashlib.sha256(data).hexdigest()[:16] + '"'
+        last_modified = email.utils.formatdate(os.path.getmtime(path),
+                                               usegmt=True)
+        if self.headers.get("If-None-Match") == etag:
+            self._send_status(304)
+            return
+        offset = 0
+        range_header = self.headers.get("Range")
+        if (range_header is not None) and \
+                (self.headers.get("If-Range") in [None, etag, last_modified]):
+            offset = int(range_header.split("=")[1].split("-")[0])
+        body = data[offset:]
+        if offset == 0:
+            self.send_response(200)
+        else:
+            self.send_response(206)
+            self.send_header("Content-Range",
+                             "bytes " + str(offset) + "-" +
+                             str(len(data) - 1) + "/" + str(len(data)))
+        server.statuses.append(206 if offset else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        if self.path in server.interrupted_paths:
+            server.interrupted_paths.remove(self.path)
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def _send_status(self, status):
+        self.server.statuses.append(status)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(root):
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                             CheckRequestHandler)
+    server.root = root
+    # The path and headers of the requests, and the status of the responses
+    server.requests = []
+    server.statuses = []
+    # The paths whose next transfer is cut halfway
+    server.interrupted_paths = set()
+    # The status of all the responses if not None
+    server.error_status = None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:" + str(server.server_address[1])
+
+
+def create_tar_archive(root, url_path, top_dir, files):
+    path = os.path.join(root, url_path.lstrip("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(top_dir + "/" + name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def check(condition, message):
+    if not condition:
+        raise RuntimeError(message)
+
+
+def check_resume(root):
+    """Cuts the transfer of an archive halfway and checks that the download
+    resumes where it stopped, then that the archive is revalidated instead
+    of being downloaded again."""
+    server, base_url = start_server(root)
+    try:
+        # Random data so that the compressed archive is large enough to be
+        # cut halfway
+        files = {"data.bin": os.urandom(4 * 1024 * 1024)}
+        url_path = "/Owner/resume/archive/master.tar.gz"
+        create_tar_archive(root, url_path, "resume-master", files)
+        server.interrupted_paths.add(url_path)
+        downloader = Downloader()
+        download = Download("resume",
+                            base_url + "/Owner/resume/archive/master.zip",
+                            "Build/")
+        download.retry_delay = 0
+        downloader.downloads.append(download)
+        downloader.set_archive_format("tar.gz")
+        downloader.download()
+        check(server.statuses[:2] == [200, 206],
+              "the transfer wasn't resumed: " + str(server.statuses))
+        path, headers = server.requests[1]
+        check(headers.get("Range", "").startswith("bytes=") and
+              (headers.get("If-Range") is not None),
+              "the transfer was resumed without Range and If-Range")
+        downloader.unzip("resume")
+        with open("Build/resume/data.bin", "rb") as file:
+            check(file.read() == files["data.bin"],
+                  "the resumed archive is corrupted")
+
+        downloader.download()
+        check(server.statuses[-1] == 304,
+              "the archive wasn't revalidated: " + str(server.statuses))
+    finally:
+        server.shutdown()
+
+
+def check_failover(root):
+    """Makes the first mirror fail and checks that the archive is downloaded
+    from the second one, and that the next package is downloaded from the
+    second mirror first."""
+    failing_server, failing_url = start_server(root)
+    server, base_url = start_server(root)
+    try:
+        failing_server.error_status = 503
+        files = {"README": b"failover\n"}
+        for name in ["failover", "failover2"]:
+            create_tar_archive(root,
+                               "/Owner/" + name + "/archive/master.tar.gz",
+                               name + "-master", files)
+        mirrors = [Mirror(failing_url), Mirror(base_url)]
+
+        def create_downloader(name):
+            downloader = Downloader()
+            downloader.downloads.append(Download(
+                name, "https://github.com/Owner/" + name +
+                "/archive/master.zip", "Build/"))
+            downloader.set_archive_format("tar.gz")
+            downloader.set_mirrors(mirrors)
+            # The scores are saved when the downloads complete and loaded
+            # again by the next downloader
+            downloader.mirror_selector = MirrorSelector(
+                "Downloads/mirror-scores.json")
+            return downloader
+
+        downloader = create_downloader("failover")
+        downloader.download()
+        check(len(failing_server.requests) != 0,
+              "the failing mirror wasn't tried first")
+        check(server.statuses == [200],
+              "the archive wasn't downloaded from the other mirror: " +
+              str(server.statuses))
+        downloader.unzip("failover")
+        with open("Build/failover/README", "rb") as file:
+            check(file.read() == files["README"],
+                  "the archive from the other mirror is corrupted")
+
+        failed_requests = len(failing_server.requests)
+        create_downloader("failover2").download()
+        check(len(failing_server.requests) == failed_requests,
+              "the failing mirror is still tried first")
+    finally:
+        failing_server.shutdown()
+        server.shutdown()
+
+
+def check_git_export(root):
+    """Fetches a package from a local bare repository in git mode, pushes a
+    commit that changes and deletes files, and checks that the fetched
+    commit is exported."""
+    repository_path = os.path.join(root, "Owner", "gitexport.git")
+    work_path = os.path.join(root, "gitexport-work")
+    os.makedirs(work_path)
+
+    def git(*args, cwd=work_path):
+        subprocess.check_call(["git", "-c", "user.name=downloadchecks",
+                               "-c", "user.email=downloadchecks@localhost",
+                               *args],
+                              cwd=cwd, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+
+    def head():
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       cwd=work_path,
+                                       universal_newlines=True).strip()
+
+    def fetch_and_export():
+        downloader = Downloader()
+        download = Download("gitexport",
+                            "file://" + root +
+                            "/Owner/gitexport/archive/master.zip",
+                            "Build/")
+        downloader.downloads.append(download)
+        downloader.set_source_mode("git")
+        downloader.download()
+        downloader.unzip("gitexport")
+        return download.metadata()["commit"]
+
+    git("init", "--bare", repository_path, cwd=root)
+    git("init")
+    git("checkout", "-b", "master")
+    with open(os.path.join(work_path, "a.txt"), "w") as file:
+        file.write("1\n")
+    with open(os.path.join(work_path, "b.txt"), "w") as file:
+        file.write("deleted by the second commit\n")
+    git("add", "a.txt", "b.txt")
+    git("commit", "-m", "First commit")
+    git("push", repository_path, "master")
+    check(fetch_and_export() == head(), "the first commit wasn't fetched")
+    with open("Build/gitexport/a.txt", "r") as file:
+        check(file.read() == "1\n", "the first commit wasn't exported")
+
+    with open(os.path.join(work_path, "a.txt"), "w") as file:
+        file.write("2\n")
+    git("rm", "b.txt")
+    git("commit", "-a", "-m", "Second commit")
+    git("push", repository_path, "master")
+    check(fetch_and_export() == head(), "the second commit wasn't fetched")
+    with open("Build/gitexport/a.txt", "r") as file:
+        check(file.read() == "2\n", "the second commit wasn't exported")
+    check(not os.path.exists("Build/gitexport/b.txt"),
+          "the file deleted by the second commit is still there")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks the download paths that depend on the behavior "
+                    "of the servers, against local HTTP servers and git "
+                    "repositories.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="show the output of the downloads")
+    args = parser.parse_args()
+
+    checks = [("Resume and revalidation", check_resume),
+              ("Mirror failover", check_failover),
+              ("Git export", check_git_export)]
+    failures = 0
+    previous_dir = os.getcwd()
+    workspace = tempfile.mkdtemp(prefix="downloadchecks-")
+    # The downloads use paths relative to the workspace
+    os.chdir(workspace)
+    try:
+        root = os.path.join(workspace, "server")
+        for name, function in checks:
+            output = io.StringIO()
+            try:
+                if args.verbose:
+                    function(root)
+                else:
+                    with contextlib.redirect_stdout(output):
+                        function(root)
+                print(name + ": OK")
+            except Exception as error:
+                failures += 1
+                print(output.getvalue(), end="")
+                print(name + ": FAILED, " + str(error))
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(workspace, ignore_errors=True)
+    if failures != 0:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+from typing import Optional
+from pathlib import Path
+import subprocess
+import tarfile
+
+
+class GitRepository:
+    """Local bare clone of a repository.
+
+    The clone is refreshed with git fetch which only transfers the objects
+    that are not in the clone yet, so keeping up with a branch costs a few
+    KB instead of a full snapshot of the branch.
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            The directory of the bare clone. It is created if it doesn't
+            exist.
+        """
+
+        self.path = path
+
+    def fetch(self, url: str, branch: str) -> str:
+        """Fetches the new commits of a branch.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the repository.
+        branch : str
+            The branch to fetch.
+
+        Returns
+        -------
+        str
+            The commit at the tip of the branch.
+        """
+        if not Path(self.path, "HEAD").is_file():
+            Path(self.path).mkdir(parents=True, exist_ok=True)
+            self._git("init", "--quiet", "--bare")
+        self._git("fetch", "--quiet", "--no-tags", url,
+                  "+refs/heads/" + branch + ":refs/heads/" + branch)
+        return self.resolve("refs/heads/" + branch)
+
+    def fetch_commit(self, url: str, commit: str):
+        """Fetches a commit if it isn't in the clone already.
+
+        Parameters
+        ----------
+        url : str
+            The URL of the repository.
+        commit : str
+            The full hash of the commit.
+        """
+        if self.resolve(commit) is None:
+            self._git("fetch", "--quiet", "--no-tags", url, commit)
+
+    def resolve(self, revision: str) -> Optional[str]:
+        """Returns the hash of a commit or tree, or None if it isn't in the
+        clone."""
+        try:
+            return self._git("rev-parse", "--verify", "--quiet",
+                             revision + "^{object}").strip()
+        except RuntimeError:
+            return None
+
+    def size(self) -> int:
+        """Returns the size of the objects in the clone in bytes."""
+        size = 0
+        for line in self._git("count-objects", "-v").splitlines():
+            name, value = line.split(":", 1)
+            if name in ["size", "size-pack"]:
+                size += int(value) * 1024
+        return size
+
+    def export(self, commit: str, prefix: str, destination: str):
+        """Writes the tree of a commit to a directory.
+
+        Parameters
+        ----------
+        commit : str
+            The commit.
+        prefix : str
+            The directory, relative to destination, the files are written
+            to.
+        destination : str
+            The directory where the prefix directory is created.
+        """
+        process = subprocess.Popen(
+            ["git", "--git-dir=" + self.path, "archive", "--format=tar",
+             "--prefix=" + prefix + "/", commit],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(destination, filter="data")
+                else:
+                    tar.extractall(destination)
+        finally:
+            process.stdout.close()
+            error = process.stderr.read()
+            process.stderr.close()
+            process.wait()
+        if process.returncode != 0:
+            raise RuntimeError("git archive " + commit + " failed: " +
+                               error.decode("utf-8", "replace").strip())
+
+    def _git(self, *args):
+        try:
+            result = subprocess.run(["git", "--git-dir=" + self.path] +
+                                    list(args),
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError("git is required to download the packages "
+                               "from their repositories")
+        if result.returncode != 0:
+            raise RuntimeError("git " + args[0] + " failed: " +
+                               result.stderr.decode("utf-8", "replace")
+                               .strip())
+        return result.stdout.decode("utf-8")
@@ -0,0 +1,211 @@
+from typing import Dict, Optional
+import http.client
+import ssl
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+class HTTPSession:
+    """HTTP client that keeps connections alive and reuses them.
+
+    Downloading the packages means sending dozens of requests to the same
+    few hosts. Reusing the connections saves the DNS lookup, the TCP
+    handshake and the TLS handshake of each request. Redirects are followed
+    on the pooled connections of the host they point to.
+
+    Requests that have to go through a proxy and URLs that are not http or
+    https URLs are handed over to urllib.
+    """
+
+    max_redirects = 10
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, max_idle_connections_per_host: int = 8):
+        """
+        Parameters
+        ----------
+        max_idle_connections_per_host : int
+            The maximum number of connections kept open to the same host while
+            they are not used.
+        """
+
+        self.max_idle_connections_per_host = max_idle_connections_per_host
+        self.connections_opened = 0
+        self.requests_sent = 0
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context()
+
+    @staticmethod
+    def shared() -> "HTTPSession":
+        """Returns the session shared by all the downloads."""
+        with HTTPSession._shared_lock:
+            if HTTPSession._shared is None:
+                HTTPSession._shared = HTTPSession()
+            return HTTPSession._shared
+
+    def open(self, url: str, headers: Optional[Dict[str, str]] = None,
+             timeout: float = 60):
+        """Sends a GET request and returns the response.
+
+        The response must be closed, preferably by using it in a with
+        statement, so that the connection can be reused.
+
+        Parameters
+        ----------
+        url : str
+            The URL.
+        headers : dict, optional
+            The headers of the request.
+        timeout : float
+            The number of seconds without receiving data after which the
+            request fails.
+
+        Returns
+        -------
+        The response. It has the same status, headers and read members as
+        the responses returned by urllib.
+
+        Raises
+        ------
+        urllib.error.HTTPError
+            If the status of the response is 304 or higher, like urlopen
+            does.
+        """
+        headers = dict(headers or {})
+        headers.setdefault("User-Agent", "CodeSmithy-Bootstrap")
+        for i in range(self.max_redirects + 1):
+            parsed_url = urllib.parse.urlsplit(url)
+            if (parsed_url.scheme not in ["http", "https"]) or \
+                    self._uses_proxy(parsed_url):
+                request = urllib.request.Request(url, headers=headers)
+                return urllib.request.urlopen(request, timeout=timeout)
+            response = self._send(parsed_url, headers, timeout)
+            if response.status in [301, 302, 303, 307, 308]:
+                location = response.headers.get("Location")
+                response.close()
+                if location is None:
+                    break
+                url = urllib.parse.urljoin(url, location)
+                continue
+            if response.status >= 300:
+                status = response.status
+                reason = response.reason
+                response_headers = response.headers
+                response.close()
+                raise urllib.error.HTTPError(url, status, reason,
+                                             response_headers, None)
+            return response
+        raise urllib.error.URLError("Too many redirects for " + url)
+
+    def close(self):
+        """Closes all the idle connections."""
+        with self._lock:
+            for connections in self._idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self._idle_connections = {}
+
+    def _send(self, parsed_url, headers, timeout):
+        key = (parsed_url.scheme, parsed_url.netloc)
+        path = parsed_url.path or "/"
+        if parsed_url.query:
+            path += "?" + parsed_url.query
+        while True:
+            connection, reused = self._acquire(key, timeout)
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError):
+                connection.close()
+                # The server may have closed an idle connection, in which
+                # case we try again with a new connection
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            with self._lock:
+                self.requests_sent += 1
+            return _PooledResponse(self, key, connection, response)
+
+    def _acquire(self, key, timeout):
+        with self._lock:
+            connections = self._idle_connections.get(key, [])
+            if len(connections) != 0:
+                connection = connections.pop()
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                return connection, True
+            self.connections_opened += 1
+        scheme, host = key
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(
+                host, timeout=timeout, context=self._ssl_context)
+        else:
+            connection = http.client.HTTPConnection(host, timeout=timeout)
+        return connection, False
+
+    def _release(self, key, connection):
+        with self._lock:
+            connections = self._idle_connections.setdefault(key, [])
+            if len(connections) < self.max_idle_connections_per_host:
+                connections.append(connection)
+                return
+        connection.close()
+
+    @staticmethod
+    def _uses_proxy(parsed_url):
+        proxies = urllib.request.getproxies()
+        if parsed_url.scheme not in proxies:
+            return False
+        return not urllib.request.proxy_bypass(parsed_url.hostname or "")
+
+
+class _PooledResponse:
+    """Wrapper that returns the connection of a response to the pool once the
+    response has been read."""
+
+    def __init__(self, session, key, connection, response):
+        self.session = session
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, size=-1):
+        if size < 0:
+            return self.response.read()
+        return self.response.read(size)
+
+    def close(self):
+        if self.connection is None:
+            return
+        # The connection can only be reused if the whole body was read,
+        # small bodies like the ones of redirects are drained
+        if not self.response.isclosed():
+            try:
+                self.response.read(65536)
+            except (OSError, http.client.HTTPException):
+                pass
+        if self.response.isclosed() and not self.response.will_close:
+            self.session._release(self.key, self.connection)
+        else:
+            self.response.close()
+            self.connection.close()
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,75 @@
+import argparse
+import http.server
+import threading
+import time
+import urllib.request
+from httpsession import HTTPSession
+
+
+class BenchmarkRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves a small archive behind a redirect, the way GitHub redirects
+    the archive URLs to codeload."""
+
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are written separately, Nagle's algorithm
+    # would hold the body back until the client acknowledges the headers
+    disable_nagle_algorithm = True
+    payload = b"x" * 16384
+
+    def do_GET(self):
+        if self.path.startswith("/archive/"):
+            self.send_response(302)
+            self.send_header("Location", "/codeload/" +
+                             self.path[len("/archive/"):])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def time_requests(open_url, url, requests):
+    start_time = time.perf_counter()
+    for i in range(requests):
+        with open_url(url) as response:
+            response.read()
+    return (time.perf_counter() - start_time) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures the time per request saved by reusing the "
+                    "connections of HTTPSession, against a local HTTP "
+                    "server.")
+    parser.add_argument("--requests", type=int, default=300,
+                        help="The number of requests sent by each client")
+    args = parser.parse_args()
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0),
+                                             BenchmarkRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        url = "http://127.0.0.1:" + str(server.server_address[1]) + \
+              "/archive/master.zip"
+        # The requests would go through the proxy otherwise
+        opener = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+        urllib_time = time_requests(opener.open, url, args.requests)
+        session = HTTPSession()
+        session_time = time_requests(session.open, url, args.requests)
+        print("Requests (each followed by a redirect): " + str(args.requests))
+        print("urllib:      {:.3f} ms per request".format(urllib_time * 1000))
+        print("HTTPSession: {:.3f} ms per request over {} connection(s)"
+              .format(session_time * 1000, session.connections_opened))
+        print("Saved:       {:.3f} ms per request".format(
+            (urllib_time - session_time) * 1000))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from typing import List
+import threading
 
 
 class Input:
@@ -6,6 +7,9 @@ class Input:
 
     def __init__(self, interactive):
         self.interactive = interactive
+        # Projects are built concurrently so questions are asked one at a
+        # time
+        self._lock = threading.Lock()
 
     def query(self, question: str, valid_answers: List[str],
               default: str) -> str:
@@ -40,6 +44,10 @@ class Input:
             The answer chosen by the user. This will be one of the items in the
             valid_answers argument or the default value.
         """
+        with self._lock:
+            return self._query(question, valid_answers, default)
+
+    def _query(self, question, valid_answers, default):
         question += self._formatted_answers(valid_answers, default)
         user_answer = None
         if self.interactive:
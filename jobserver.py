@@ -0,0 +1,119 @@
+from contextlib import contextmanager
+from typing import Optional
+import atexit
+import os
+import select
+import shutil
+import tempfile
+import threading
+
+
+class Jobserver:
+    """GNU make jobserver shared by all the builds.
+
+    The jobserver owns a budget of job tokens. Every project build holds a
+    token while it runs, and the make processes it starts take additional
+    tokens from the same fifo for their parallel jobs. The projects built at
+    the same time therefore never run more than the budget of jobs in total,
+    however the work is spread between them.
+
+    The make processes find the fifo through the --jobserver-auth option in
+    the MAKEFLAGS environment variable. GNU make 4.2 or later is given the
+    file descriptors of the fifo, Ninja 1.13 or later only understands the
+    path of the fifo, see subprocess_args. On Windows the budget only limits
+    the number of projects built at the same time.
+    """
+
+    def __init__(self, jobs: int):
+        """
+        Parameters
+        ----------
+        jobs : int
+            The total number of jobs that can run at the same time.
+        """
+
+        self.jobs = max(1, jobs or 1)
+        self.fifo_path = None
+        self._fd = None
+        self._poll_fd = None
+        self._semaphore = None
+        if os.name == "nt":
+            self._semaphore = threading.BoundedSemaphore(self.jobs)
+        else:
+            directory = tempfile.mkdtemp(prefix="bootstrap-jobserver-")
+            atexit.register(shutil.rmtree, directory, True)
+            self.fifo_path = os.path.join(directory, "fifo")
+            os.mkfifo(self.fifo_path, 0o600)
+            # Opened for reading and writing so that the reads block until a
+            # token is available instead of failing when no one else has the
+            # fifo open for writing
+            self._fd = os.open(self.fifo_path, os.O_RDWR)
+            # Another open file description, the make processes can't make
+            # the other one non-blocking under its feet
+            self._poll_fd = os.open(self.fifo_path,
+                                    os.O_RDONLY | os.O_NONBLOCK)
+            os.write(self._fd, b"+" * self.jobs)
+
+    @contextmanager
+    def token(self):
+        """Holds a token for the duration of a with statement."""
+        token = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def acquire(self) -> bytes:
+        """Takes a token, waiting until one is available."""
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+            return b"+"
+        while True:
+            # The make processes may have made the fifo non-blocking
+            select.select([self._fd], [], [])
+            try:
+                return os.read(self._fd, 1)
+            except BlockingIOError:
+                pass
+
+    def try_acquire(self) -> Optional[bytes]:
+        """Takes a token if one is available, returns None otherwise."""
+        if self._semaphore is not None:
+            if self._semaphore.acquire(False):
+                return b"+"
+            return None
+        try:
+            return os.read(self._poll_fd, 1)
+        except BlockingIOError:
+            return None
+
+    def release(self, token: bytes):
+        """Gives back a token taken with acquire."""
+        if self._semaphore is not None:
+            self._semaphore.release()
+        else:
+            os.write(self._fd, token)
+
+    def subprocess_args(self, fifo: bool = False) -> dict:
+        """Returns the keyword arguments to pass to subprocess so that the
+        make processes started by the subprocess use the jobserver.
+
+        The process started must hold a token, it runs its first job on it.
+
+        Parameters
+        ----------
+        fifo : bool
+            If True the path of the fifo is passed, as understood by GNU make
+            4.4 and Ninja 1.13 or later. Otherwise its file descriptors are
+            passed, as understood by GNU make 4.2 or later.
+        """
+        if self._semaphore is not None:
+            return {}
+        env = dict(os.environ)
+        if fifo:
+            env["MAKEFLAGS"] = "-j" + str(self.jobs) + \
+                " --jobserver-auth=fifo:" + self.fifo_path
+            return {"env": env}
+        env["MAKEFLAGS"] = "-j" + str(self.jobs) + " --jobserver-auth=" + \
+            str(self._fd) + "," + str(self._fd)
+        return {"env": env, "pass_fds": (self._fd,)}
@@ -0,0 +1,93 @@
+from typing import List
+import json
+import os
+from download import Downloader
+
+
+class LockFile:
+    """Records the exact archives used by a bootstrap build.
+
+    For each download the lockfile records the commit the archive was
+    generated from, the size of the archive and its SHA-256 digest, and its
+    BLAKE2b digest if it was computed. Only the commit is recorded for the
+    packages fetched with git. The entries are keyed by the URL of the branch
+    archive.
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            The path of the lockfile.
+        """
+
+        self.path = path
+        self.entries = {}
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                self.entries = json.loads(file.read())["downloads"]
+        except (OSError, ValueError, KeyError) as error:
+            raise RuntimeError("Failed to read lockfile " + self.path + ": " +
+                               str(error))
+
+    def save(self):
+        with open(self.path, "w") as file:
+            file.write(json.dumps({"downloads": self.entries}, indent=4,
+                                  sort_keys=True))
+            file.write("\n")
+
+    def pin(self, downloader: Downloader):
+        """Pins all the downloads to the archives recorded in the lockfile.
+
+        Parameters
+        ----------
+        downloader : Downloader
+            The downloader with the downloads to pin.
+        """
+        for download in downloader.downloads:
+            if download.url not in self.entries:
+                raise RuntimeError(download.name + " (" + download.url +
+                                   ") is not in lockfile " + self.path)
+            entry = self.entries[download.url]
+            if (download.source_mode == "git") and (entry["commit"] is None):
+                raise RuntimeError(download.name + " has no commit in "
+                                   "lockfile " + self.path)
+            download.pin(entry["commit"], entry.get("size"),
+                         entry.get("sha256"), entry.get("blake2b"))
+
+    def update(self, downloader: Downloader) -> List[str]:
+        """Records the archives that have been downloaded.
+
+        Parameters
+        ----------
+        downloader : Downloader
+            The downloader that was used to download the archives.
+
+        Returns
+        -------
+        List[str]
+            The names of the downloads whose entry changed.
+        """
+        entries = {}
+        changed = []
+        for download in downloader.downloads:
+            metadata = download.metadata()
+            if metadata is None:
+                raise RuntimeError(download.name + " hasn't been downloaded")
+            entry = {"name": download.name,
+                     "commit": metadata["commit"]}
+            # Packages fetched with git only have a commit
+            for key in ["size", "sha256", "blake2b"]:
+                if metadata.get(key) is not None:
+                    entry[key] = metadata[key]
+            if self.entries.get(download.url) != entry:
+                changed.append(download.name)
+            entries[download.url] = entry
+        self.entries = entries
+        return changed
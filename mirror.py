@@ -0,0 +1,178 @@
+from typing import List, Optional
+from pathlib import Path
+import json
+import os
+import threading
+import urllib.parse
+import zipfile
+from download import Downloader
+
+
+class Mirror:
+    """A local copy of the download sources.
+
+    The mirror is a directory, or an HTTP server serving that directory,
+    where the archives are stored at the same path as in their original URL.
+    For instance https://github.com/CodeSmithyIDE/pugixml/archive/master.zip
+    is found at CodeSmithyIDE/pugixml/archive/master.zip in the mirror.
+    """
+
+    def __init__(self, location: str):
+        """
+        Parameters
+        ----------
+        location : str
+            The URL of the mirror or the path of the mirror directory.
+        """
+
+        if "://" in location:
+            self.base_url = location.rstrip("/")
+        else:
+            if not os.path.isdir(location):
+                raise RuntimeError("Mirror directory " + location +
+                                   " not found")
+            self.base_url = Path(location).resolve().as_uri()
+
+    def url(self, url: str) -> str:
+        """Returns the URL of the mirrored copy of a URL."""
+        return self.base_url + urllib.parse.urlsplit(url).path
+
+    @staticmethod
+    def create_bundle(downloader: Downloader, path: str):
+        """Packs all the downloaded archives in a mirror bundle.
+
+        The bundle is a zip file that can be unzipped to create a mirror
+        directory. It also contains a manifest.json file that lists the
+        archives with their original URL, SHA-256 digest, size and commit.
+
+        Parameters
+        ----------
+        downloader : Downloader
+            The downloader that was used to download the archives.
+        path : str
+            The path of the bundle.
+        """
+        manifest = []
+        # The archives are already compressed
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as bundle:
+            for download in downloader.downloads:
+                if download.source_mode != "archive":
+                    raise RuntimeError("Mirror bundles can only be created "
+                                       "from archives")
+                metadata = download.metadata()
+                if metadata is None:
+                    raise RuntimeError(download.name + " hasn't been "
+                                       "downloaded")
+                archive_path = urllib.parse.urlsplit(download.url).path
+                archive_path = archive_path.lstrip("/")
+                bundle.write(download.download_path, archive_path)
+                manifest.append({"url": download.url,
+                                 "path": archive_path,
+                                 "sha256": metadata["sha256"],
+                                 "size": metadata["size"],
+                                 "commit": metadata["commit"]})
+            bundle.writestr("manifest.json",
+                            json.dumps({"downloads": manifest}, indent=4))
+
+
+class MirrorSelector:
+    """Chooses which mirror to download a package from.
+
+    The latency and throughput measured for each mirror are kept as moving
+    averages and saved so they carry over to the next executions. Mirrors
+    are tried from the fastest to the slowest, except mirrors that have never
+    been measured which are tried first so that they get a score.
+    """
+
+    # A transfer is moved to another mirror when that mirror is known to be
+    # this many times faster than what the first chunk was received at
+    slow_factor = 4
+    # Weight of the latest measurement in the moving averages
+    smoothing = 0.5
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            The path of the file where the scores are saved.
+        """
+
+        self.path = path
+        self.scores = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, "r") as file:
+                self.scores = json.loads(file.read())
+        except (OSError, ValueError):
+            pass
+
+    def rank(self, mirrors: List[str]) -> List[str]:
+        """Sorts mirrors from the most to the least promising.
+
+        Parameters
+        ----------
+        mirrors : List[str]
+            The base URLs of the mirrors.
+        """
+        with self._lock:
+            def key(mirror):
+                score = self.scores.get(mirror)
+                if score is None:
+                    return (0, 0)
+                return (1, -score["throughput"] / (1 + score["failures"]))
+            return sorted(mirrors, key=key)
+
+    def faster(self, mirror: str, throughput: float,
+               mirrors: List[str]) -> Optional[str]:
+        """Returns a mirror that is much faster than the throughput measured
+        for a mirror, or None if there is no such mirror."""
+        with self._lock:
+            best = None
+            best_throughput = throughput * self.slow_factor
+            for other in mirrors:
+                score = self.scores.get(other)
+                if (other == mirror) or (score is None) or \
+                        (score["failures"] != 0):
+                    continue
+                if score["throughput"] > best_throughput:
+                    best = other
+                    best_throughput = score["throughput"]
+            return best
+
+    def record(self, mirror: str, latency: float, throughput: float):
+        """Records a measurement for a mirror.
+
+        Parameters
+        ----------
+        mirror : str
+            The base URL of the mirror.
+        latency : float
+            The number of seconds until the response was received.
+        throughput : float
+            The throughput in bytes per second.
+        """
+        with self._lock:
+            score = self.scores.get(mirror)
+            if score is None:
+                self.scores[mirror] = {"latency": latency,
+                                       "throughput": throughput,
+                                       "failures": 0}
+            else:
+                score["latency"] += self.smoothing * \
+                    (latency - score["latency"])
+                score["throughput"] += self.smoothing * \
+                    (throughput - score["throughput"])
+                score["failures"] = 0
+
+    def record_failure(self, mirror: str):
+        with self._lock:
+            score = self.scores.setdefault(
+                mirror, {"latency": 0, "throughput": 0, "failures": 0})
+            score["failures"] += 1
+
+    def save(self):
+        with self._lock:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "w") as file:
+                file.write(json.dumps(self.scores, indent=4))
@@ -1,7 +1,13 @@
 import json
+import sys
+import threading
 
 
 class Output:
+    # Serializes the lines printed by the threads that download and build
+    # the packages at the same time
+    _print_lock = threading.Lock()
+
     def __init__(self):
         self.current_step = 1
         with open('predefined_strings.json', 'r') as file:
@@ -16,8 +22,33 @@ class Output:
         print('-' * len(title))
         print("")
 
-    def print_step_title(self, title):
-        print("Step " + str(self.current_step) + ": " + title, flush=True)
+    def print_step_title(self, title, blank_line=False):
+        """Prints the title of the current step.
+
+        Parameters
+        ----------
+        title : str
+            The title of the step.
+        blank_line : bool
+            If True the title is preceded by a blank line, printed together
+            with it so that no other thread prints in between.
+        """
+        line = "Step " + str(self.current_step) + ": " + title
+        if blank_line:
+            line = "\n" + line
+        Output.print_line(line)
+
+    @staticmethod
+    def print_line(line):
+        """Prints a line from any thread.
+
+        print writes the text and the line break separately, so the lines
+        printed by several threads at the same time can get mixed up. The
+        line is written in one go instead, and flushed.
+        """
+        with Output._print_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
 
     def next_step(self):
         self.current_step += 1
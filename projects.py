@@ -1,13 +1,19 @@
-from typing import Optional
+from typing import Dict, List, Optional
+import hashlib
+import json
 import os
 import re
 import subprocess
+import time
 from pathlib import Path
 from download import Downloader
 from download import Download
 from input import Input
 from output import Output
 from build import BuildTools, BuildConfiguration
+from cmake import CMake
+from buildscheduler import BuildScheduler
+from buildhistory import BuildHistory
 
 
 class Project:
@@ -17,7 +23,8 @@ class Project:
                  name: str,
                  env_var: str,
                  makefile_path: Optional[str],
-                 use_codesmithy_make: bool):
+                 use_codesmithy_make: bool,
+                 dependencies: Optional[List[str]] = None):
         """
         Parameters
         ----------
@@ -33,6 +40,9 @@ class Project:
             the project only needs to be downloaded.
         use_codesmithy_make : bool
             Whether CodeSmithyMake should be used to build the project.
+        dependencies : List[str], optional
+            The names of the projects that must be built before this
+            project.
         """
 
         self.name = name
@@ -42,6 +52,7 @@ class Project:
         else:
             self.makefile_path = "Build/" + name + "/" + makefile_path
         self.use_codesmithy_make = use_codesmithy_make
+        self.dependencies = list(dependencies or [])
         self.cmake_generation_args = []
 
         split_name = name.split("/")
@@ -118,11 +129,21 @@ class Project:
             The input helper.
         output : Output
             The output helper.
+
+        Raises
+        ------
+        RuntimeError
+            If the build failed. The message starts with the name of the
+            project since several projects can be built at the same time.
         """
 
+        # Several projects can be built at the same time so their messages
+        # are prefixed with their name
+        prefix = "    " + self.name + ": "
         try:
             if self.makefile_path is None:
-                print("    No build required for this project")
+                Output.print_line(prefix +
+                                  "No build required for this project")
             else:
                 cmake = build_tools.cmake
                 compiler = build_tools.compiler
@@ -133,25 +154,84 @@ class Project:
                 if not os.path.exists(resolved_makefile_path):
                     raise RuntimeError(resolved_makefile_path + " not found")
                 if self.use_codesmithy_make:
-                    print("    Using CodeSmithyMake")
+                    Output.print_line(prefix + "Using CodeSmithyMake")
                     codesmithymake.build(compiler, resolved_makefile_path,
                                          build_configuration.codesmithymake_configuration,
                                          input)
-                elif self.makefile_path.endswith("/CMakeLists.txt"):
-                    log = self.name + "_build.log"
-                    print("    Using CMake, build log: " + log)
+                elif self.uses_cmake():
+                    build_dir = CMake.build_dir(self.name,
+                                                build_configuration)
+                    log = os.path.basename(self.name) + "_build.log"
+                    Output.print_line(prefix + "Using CMake, build log: " +
+                                      build_dir + "/" + log)
                     cmake.build(resolved_makefile_path, build_configuration,
-                                log)
+                                log, build_dir, self.name)
                 else:
-                    print("    Using " + compiler.name)
+                    Output.print_line(prefix + "Using " + compiler.name)
                     compiler.compile(resolved_makefile_path,
                                      build_configuration.compiler_configuration,
                                      input)
-                print("    Project build successfully")
+                Output.print_line(prefix + "Project build successfully")
             self.built = True
-        except RuntimeError:
-            print("    Failed to build project")
-            raise
+        except RuntimeError as error:
+            Output.print_line(prefix + "Failed to build project")
+            raise RuntimeError(self.name + ": " + str(error)) from error
+
+    def uses_cmake(self) -> bool:
+        """Returns True if the project is built with CMake."""
+        return (self.makefile_path is not None) and \
+            (not self.use_codesmithy_make) and \
+            self.makefile_path.endswith("/CMakeLists.txt")
+
+    def fingerprint(self, compiler,
+                    parent_build_configuration: BuildConfiguration,
+                    downloader: Downloader,
+                    dependency_fingerprints: Dict[str, str]) -> Optional[str]:
+        """Computes a digest of everything the build of the project depends
+        on.
+
+        The project only needs to be built again if its fingerprint changed
+        since it was last built.
+
+        Parameters
+        ----------
+        compiler
+            The compiler used to build the project.
+        parent_build_configuration : BuildConfiguration
+            The parent build configuration.
+        downloader : Downloader
+            The downloader that was used to download the package(s).
+        dependency_fingerprints : Dict[str, str]
+            The fingerprints of the dependencies of the project.
+
+        Returns
+        -------
+        str, optional
+            The fingerprint, or None if a package hasn't been downloaded or a
+            dependency has no fingerprint, in which case the project must be
+            built.
+        """
+        package_digests = {}
+        for download in self.create_downloader().downloads:
+            package_digests[download.name] = \
+                downloader.get(download.name).content_digest()
+        dependencies = {name: dependency_fingerprints.get(name)
+                        for name in self.dependencies}
+        if (None in package_digests.values()) or \
+                (None in dependencies.values()):
+            return None
+        build_configuration = BuildConfiguration(parent_build_configuration)
+        build_configuration.cmake_generation_args.extend(
+            self.cmake_generation_args)
+        inputs = {"name": self.name,
+                  "makefile_path": self.makefile_path,
+                  "use_codesmithy_make": self.use_codesmithy_make,
+                  "packages": package_digests,
+                  "build_configuration": vars(build_configuration),
+                  "compiler": compiler.identity(),
+                  "dependencies": dependencies}
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True)
+                              .encode("utf-8")).hexdigest()
 
     def launch(self, compiler, architecture_dir_name):
         compiler.launch(self._resolve_makefile_path(compiler,
@@ -205,20 +285,15 @@ class wxWidgetsProject(Project):
 
     def unzip(self, downloader):
         super().unzip(downloader)
-        downloader.unzip("zlib")
-        downloader.unzip("libpng")
-        os.rmdir("Build/wxWidgets/src/png")
-        os.rename("Build/wxWidgets/src/libpng", "Build/wxWidgets/src/png")
-        downloader.unzip("libexpat")
-        os.rmdir("Build/wxWidgets/src/expat")
-        os.rename("Build/wxWidgets/src/libexpat", "Build/wxWidgets/src/expat")
-        downloader.unzip("libjpeg-turbo")
-        os.rmdir("Build/wxWidgets/src/jpeg")
-        os.rename("Build/wxWidgets/src/libjpeg-turbo",
-                  "Build/wxWidgets/src/jpeg")
-        downloader.unzip("libtiff")
-        os.rmdir("Build/wxWidgets/src/tiff")
-        os.rename("Build/wxWidgets/src/libtiff", "Build/wxWidgets/src/tiff")
+        # The submodules are unzipped in different directories so they can
+        # be unzipped at the same time. They replace the empty directories
+        # of the git submodules in the wxWidgets archive.
+        downloader.unzip_concurrently({
+            "zlib": None,
+            "libpng": ["Build/wxWidgets/src/png"],
+            "libexpat": ["Build/wxWidgets/src/expat"],
+            "libjpeg-turbo": ["Build/wxWidgets/src/jpeg"],
+            "libtiff": ["Build/wxWidgets/src/tiff"]})
 
     def _resolve_makefile_path(self, compiler, architecture_dir_name):
         return re.sub(r"\$\(compiler_short_name\)",
@@ -232,146 +307,192 @@ class Test:
         self.executable = executable
 
 
+# The project that builds CodeSmithyMake
+codesmithymake_project = "CodeSmithyIDE/CodeSmithy/CLI"
+
+# The task of the build graph that installs CMake
+cmake_task = "CMake"
+
+
 class Projects:
     def __init__(self, target):
+        self.target = target
         self.downloader = Downloader()
         self.projects = []
         self.projects.append(Project(
             "pugixml",
             "PUGIXML",
             None,
-            False))
+            False,
+            []))
         self.projects.append(libgit2Project(target))
         self.projects.append(Project(
             "Ishiko/Platform",
             "ISHIKO_CPP",
             None,
-            False))
+            False,
+            []))
         self.projects.append(Project(
             "Ishiko/Errors",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoErrors.sln",
-            False))
+            False,
+            ["Ishiko/Platform"]))
         self.projects.append(Project(
             "Ishiko/Types",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoTypes.sln",
-            False))
+            False,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "Ishiko/Process",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoProcess.sln",
-            False))
+            False,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "Ishiko/Collections",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoCollections.sln",
-            False))
+            False,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "Ishiko/FileSystem",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoFileSystem.sln",
-            False))
+            False,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "Ishiko/Terminal",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoTerminal.sln",
-            False))
+            False,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "Ishiko/Tasks",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoTasks.sln",
-            False))
+            False,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "DiplodocusDB/Core",
             "DIPLODOCUSDB",
             "Makefiles/$(compiler_short_name)/DiplodocusDBCore.sln",
-            False))
+            False,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "DiplodocusDB/TreeDB/Core",
             "DIPLODOCUSDB",
             "Makefiles/$(compiler_short_name)/DiplodocusTreeDBCore.sln",
-            False))
+            False,
+            ["DiplodocusDB/Core"]))
         self.projects.append(Project(
             "DiplodocusDB/TreeDB/XMLTreeDB",
             "DIPLODOCUSDB",
             "Makefiles/$(compiler_short_name)/DiplodocusXMLTreeDB.sln",
-            False))
+            False,
+            ["pugixml", "Ishiko/FileSystem", "DiplodocusDB/TreeDB/Core"]))
         self.projects.append(Project(
             "CodeSmithyIDE/VersionControl/Git",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyGit.sln",
-            False))
+            False,
+            ["libgit2", "Ishiko/Errors"]))
         self.projects.append(Project(
             "CodeSmithyIDE/BuildToolchains",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyBuildToolchains.sln",
-            False))
+            False,
+            ["Ishiko/Process"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/Core",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyCore.sln",
-            False))
+            False,
+            ["Ishiko/Collections",
+             "Ishiko/FileSystem",
+             "DiplodocusDB/TreeDB/XMLTreeDB",
+             "CodeSmithyIDE/VersionControl/Git",
+             "CodeSmithyIDE/BuildToolchains"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/CLI",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyCLI.sln",
-            False))
+            False,
+            ["Ishiko/Terminal", "CodeSmithyIDE/CodeSmithy/Core"]))
         self.projects.append(Project(
             "Ishiko/TestFramework/Core",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoTestFrameworkCore.sln",
-            True))
+            True,
+            ["Ishiko/Process", "Ishiko/FileSystem"]))
         self.projects.append(Project(
             "Ishiko/WindowsRegistry",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoWindowsRegistry.sln",
-            True))
+            True,
+            ["Ishiko/Errors"]))
         self.projects.append(Project(
             "Ishiko/FileTypes",
             "ISHIKO_CPP",
             "Makefiles/$(compiler_short_name)/IshikoFileTypes.sln",
-            True))
+            True,
+            ["Ishiko/FileSystem"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/UICore",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyUICore.sln",
-            True))
+            True,
+            ["CodeSmithyIDE/CodeSmithy/Core"]))
         self.projects.append(wxWidgetsProject())
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/UIElements",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyUIElements.sln",
-            True))
+            True,
+            ["wxWidgets", "CodeSmithyIDE/CodeSmithy/UICore"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/UIImplementation",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyUIImplementation.sln",
-            True))
+            True,
+            ["Ishiko/WindowsRegistry",
+             "Ishiko/FileTypes",
+             "CodeSmithyIDE/CodeSmithy/UIElements"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/UI",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithy.sln",
-            True))
+            True,
+            ["CodeSmithyIDE/CodeSmithy/UIImplementation"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/Tests/Core",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyCoreTests.sln",
-            True))
+            True,
+            ["Ishiko/TestFramework/Core", "CodeSmithyIDE/CodeSmithy/Core"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/Tests/Make",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyMakeTests.sln",
-            True))
+            True,
+            ["Ishiko/TestFramework/Core", "CodeSmithyIDE/CodeSmithy/Core"]))
         self.projects.append(Project(
             "CodeSmithyIDE/CodeSmithy/Tests/UICore",
             "CODESMITHYIDE",
             "Makefiles/$(compiler_short_name)/CodeSmithyUICoreTests.sln",
-            True))
+            True,
+            ["Ishiko/TestFramework/Core", "CodeSmithyIDE/CodeSmithy/UICore"]))
+        # CodeSmithyMake is built by the CLI project
+        for project in self.projects:
+            if project.use_codesmithy_make and \
+                    (codesmithymake_project not in project.dependencies):
+                project.dependencies.append(codesmithymake_project)
+        BuildScheduler.check(self.dependency_graph())
         self.tests = []
         self.tests.append(Test("CodeSmithyIDE/CodeSmithy/Tests/Core",
                                "CodeSmithyCoreTests.exe"))
-        self._init_downloader()
+        self._init_downloader(target)
 
     def get(self, name):
         for project in self.projects:
@@ -399,32 +520,163 @@ class Projects:
             os.environ[var_name] = env[var_name]
         output.next_step()
 
-    def download(self):
-        self.downloader.download()
+    def download(self, output=None):
+        self.downloader.download(output)
+
+    def unzip(self):
+        """Unzips the packages of all the projects."""
+        for project in self.projects:
+            project.unzip(self.downloader)
+        if self.downloader.get("CMake") is not None:
+            self.downloader.unzip("CMake")
+
+    def dependency_graph(self):
+        """Returns the names of the dependencies of each project, in the
+        order the projects are listed."""
+        return {project.name: project.dependencies
+                for project in self.projects}
 
     def build(self, build_tools, build_configuration,
-              input, state, output):
-        # For now only bypass pugixml, libgit2 and wxWidgets because they
-        # are independent from the rest. More complex logic is required to
-        # handle the other projects.
-        # Unless we have built all project succesfully.
+              input, state, output, jobs=1,
+              history: Optional[BuildHistory] = None):
+        """Builds the projects.
+
+        A project is built once all its dependencies have been built and its
+        packages have been downloaded, so the projects can be built while the
+        packages started with Downloader.start_download are still being
+        downloaded. Up to jobs projects are built at the same time.
+
+        CMake is installed by a task of the same graph that only the projects
+        built with CMake depend on, so the other projects are built while
+        CMake is being installed.
+
+        If a build history is given, the durations of the previous builds are
+        used to start the projects on the longest remaining dependency chains
+        first, and the duration of each build is recorded in it.
+
+        A project is only built if its fingerprint differs from the one
+        recorded when it was last built. The fingerprints of the dependencies
+        are part of the fingerprint so a change propagates to all the
+        projects that depend on it.
+        """
+        fingerprints = {}
+        package_names = {}
+        prerequisites = {}
         for project in self.projects:
-            if state.build_complete:
-                project.built = True
-            elif project.name in ["libgit2", "pugixml", "wxWidgets"]:
-                if project.name in state.built_projects:
-                    project.built = True
+            package_names[project.name] = \
+                [download.name
+                 for download in project.create_downloader().downloads]
+            prerequisites[project.name] = \
+                [self.downloader.download_future(name)
+                 for name in package_names[project.name]
+                 if self.downloader.download_future(name) is not None]
+
+        dependencies = self.dependency_graph()
+        dependencies[cmake_task] = []
         for project in self.projects:
-            print("")
-            output.print_step_title("Building " + project.name)
-            if project.built:
-                print("    Using previous execution")
+            if project.uses_cmake():
+                dependencies[project.name] = \
+                    dependencies[project.name] + [cmake_task]
+        prerequisites[cmake_task] = []
+        if self.downloader.download_future("CMake") is not None:
+            prerequisites[cmake_task].append(
+                self.downloader.download_future("CMake"))
+
+        scheduler = BuildScheduler(jobs)
+        priorities = None
+        durations = {}
+        if history is not None:
+            # Whether a project is up to date is only known once its
+            # packages are downloaded, so every project is expected to be
+            # rebuilt. A project found up to date only shortens the chains of
+            # the projects it depends on, which have already been built by
+            # then, so the priorities would not change.
+            for project in self.projects:
+                durations[project.name] = history.estimate(project.name)
+            if state.cmake_path == "":
+                durations[cmake_task] = history.estimate(cmake_task)
+            else:
+                durations[cmake_task] = 0
+            priorities = BuildScheduler.critical_path_lengths(dependencies,
+                                                              durations)
+        # The tasks that did not find their result from a previous execution
+        rebuilt = set()
+
+        def start(name):
+            if name == cmake_task:
+                output.print_step_title("Installing CMake", blank_line=True)
             else:
-                project.unzip(self.downloader)
-                project.build(build_tools, build_configuration,
-                              input, output)
-            state.set_built_project(project.name)
+                output.print_step_title("Building " + name, blank_line=True)
             output.next_step()
+
+        def install_cmake():
+            installed = (state.cmake_path != "")
+            start_time = time.monotonic()
+            build_tools.cmake.install(self.target, state, self.downloader)
+            if not installed:
+                rebuilt.add(cmake_task)
+                if history is not None:
+                    history.record(cmake_task,
+                                   time.monotonic() - start_time)
+
+        def build(name):
+            if name == cmake_task:
+                install_cmake()
+                return
+            project = self.get(name)
+            for package_name in package_names[name]:
+                self.downloader.wait_for_download(package_name)
+            # The fingerprints of the dependencies are known since they have
+            # been built
+            fingerprint = project.fingerprint(
+                build_tools.compiler, build_configuration, self.downloader,
+                fingerprints)
+            fingerprints[name] = fingerprint
+            if (fingerprint is not None) and \
+                    (state.project_fingerprints.get(name) == fingerprint):
+                project.built = True
+            if project.built:
+                Output.print_line("    " + name + ": using previous execution")
+                return
+            rebuilt.add(name)
+            project.unzip(self.downloader)
+            start_time = time.monotonic()
+            if build_tools.jobserver is None:
+                project.build(build_tools, build_configuration, input,
+                              output)
+            else:
+                # The build runs its first job on this token, and takes more
+                # tokens from the jobserver for its other jobs
+                with build_tools.jobserver.token():
+                    project.build(build_tools, build_configuration, input,
+                                  output)
+            if history is not None:
+                history.record(name, time.monotonic() - start_time)
+
+        def complete(name):
+            if name != cmake_task:
+                state.set_built_project(name, fingerprints[name])
+
+        start_time = time.monotonic()
+        try:
+            scheduler.run(dependencies, build, start, complete, priorities,
+                          prerequisites)
+        finally:
+            if history is not None:
+                history.save()
+        if history is not None:
+            # Predicted over the tasks that actually ran, with the durations
+            # expected before the run
+            predicted_makespan = scheduler.predict_makespan(
+                dependencies,
+                {name: (durations[name] if name in rebuilt else 0)
+                 for name in dependencies},
+                priorities)
+            # The download step may still be printing its last lines
+            Output.print_line("")
+            Output.print_line("    Build time: predicted " +
+                              str(round(predicted_makespan)) + "s, actual " +
+                              str(round(time.monotonic() - start_time)) + "s")
         state.set_build_complete()
 
     def test(self, compiler, architecture_dir_name, input):
@@ -442,7 +694,10 @@ class Projects:
                                                        architecture_dir_name)
                 raise RuntimeError(test.project_name + " tests failed.")
 
-    def _init_downloader(self):
+    def _init_downloader(self, target):
+        # The CMake source package is downloaded first since the projects
+        # built with CMake can't start before it is installed
+        self.downloader.merge(CMake.create_downloader(target))
         for project in self.projects:
             project_downloader = project.create_downloader()
             self.downloader.merge(project_downloader)
@@ -1,10 +1,14 @@
 import json
+import threading
 
 
 class State:
     """Stores information about the state of the bootstrap procedure."""
 
     def __init__(self):
+        # The download step can complete on a download thread, the state is
+        # only changed and saved while holding the lock
+        self._lock = threading.RLock()
         self.reset_variables()
         try:
             with open('state.json', 'r') as file:
@@ -18,44 +22,57 @@ class State:
                 for project in built_projects_list:
                     self.built_projects.add(project)
                 self.build_complete = state["build_complete"]
+                # Not present in the state of older versions
+                self.project_fingerprints = state.get("project_fingerprints",
+                                                      {})
                 self.previous_state_found = True
         except IOError:
             self.save()
 
     def reset(self):
-        self.reset_variables()
-        self.save()
+        with self._lock:
+            self.reset_variables()
+            self.save()
 
     def set_architecture(self, architecture):
-        self.architecture = architecture
-        self.save()
+        with self._lock:
+            self.architecture = architecture
+            self.save()
 
     def set_download_complete(self):
-        self.download_complete = True
-        self.save()
+        with self._lock:
+            self.download_complete = True
+            self.save()
 
     def set_selected_compiler(self, compiler):
-        self.selected_compiler = compiler
-        self.save()
+        with self._lock:
+            self.selected_compiler = compiler
+            self.save()
 
     def set_compiler_configuration(self, configuration):
-        self.compiler_configuration = configuration
-        self.save()
+        with self._lock:
+            self.compiler_configuration = configuration
+            self.save()
 
     def set_cmake_path(self, path):
-        self.cmake_path = path
-        self.save()
+        with self._lock:
+            self.cmake_path = path
+            self.save()
 
-    def set_built_project(self, project):
-        self.built_projects.add(project)
-        self.save()
+    def set_built_project(self, project, fingerprint=None):
+        with self._lock:
+            self.built_projects.add(project)
+            if fingerprint is not None:
+                self.project_fingerprints[project] = fingerprint
+            self.save()
 
     def set_build_complete(self):
-        self.build_complete = True
-        self.save()
+        with self._lock:
+            self.build_complete = True
+            self.save()
 
     def save(self):
-        with open('state.json', 'w+') as file:
+        with self._lock:
             built_projects_list = []
             for project in self.built_projects:
                 built_projects_list.append(project)
@@ -65,8 +82,12 @@ class State:
                      "compiler_configuration": self.compiler_configuration,
                      "cmake_path": self.cmake_path,
                      "built_projects": built_projects_list,
-                     "build_complete": self.build_complete}
-            file.write(json.dumps(state))
+                     "build_complete": self.build_complete,
+                     "project_fingerprints": self.project_fingerprints}
+            # Serialized before the file is truncated
+            contents = json.dumps(state)
+            with open('state.json', 'w+') as file:
+                file.write(contents)
 
     def reset_variables(self):
         self.previous_state_found = False
@@ -77,3 +98,4 @@ class State:
         self.cmake_path = ""
         self.built_projects = set()
         self.build_complete = False
+        self.project_fingerprints = {}
@@ -0,0 +1,116 @@
+from pathlib import Path
+import os
+import queue
+import shutil
+import threading
+
+
+class Trash:
+    """Deletes directory trees in the background.
+
+    A tree is first renamed into the trash directory, which is instant, and
+    then deleted by a background thread. The path of the tree can be reused
+    straight away as the tree being deleted has a unique name in the trash
+    directory.
+
+    Trees left in the trash directory by an execution that stopped before
+    they were deleted are deleted by the next execution.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            The trash directory. It must be on the same file system as the
+            trees to delete, otherwise they are deleted synchronously.
+        """
+
+        self.path = os.path.abspath(path)
+        self._pending = queue.Queue()
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        if os.path.isdir(self.path):
+            for entry in os.scandir(self.path):
+                self._schedule(entry.path)
+
+    @staticmethod
+    def shared() -> "Trash":
+        """Returns the trash of the workspace, the .trash directory in the
+        current directory."""
+        with Trash._shared_lock:
+            if Trash._shared is None:
+                Trash._shared = Trash(".trash")
+            return Trash._shared
+
+    def move(self, path: str):
+        """Moves a tree to the trash.
+
+        Parameters
+        ----------
+        path : str
+            The directory to delete.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the directory doesn't exist.
+        OSError
+            If the directory couldn't be deleted, for instance because some
+            of its files are in use.
+        """
+        if not os.path.lexists(path):
+            raise FileNotFoundError(path)
+        with self._lock:
+            self._counter += 1
+            trash_path = os.path.join(
+                self.path, os.path.basename(os.path.normpath(path)) + "-" +
+                str(os.getpid()) + "-" + str(self._counter))
+        Path(self.path).mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(path, trash_path)
+        except OSError:
+            # Most likely the trash directory is on another file system
+            shutil.rmtree(path)
+            return
+        self._schedule(trash_path)
+
+    def remove(self, path: str):
+        """Moves a tree to the trash, ignoring errors like
+        shutil.rmtree(path, ignore_errors=True) does."""
+        try:
+            self.move(path)
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def wait(self):
+        """Waits until all the trees in the trash have been deleted."""
+        self._pending.join()
+
+    def _schedule(self, trash_path):
+        self._pending.put(trash_path)
+        with self._lock:
+            if self._thread is None:
+                # A daemon thread so that a deletion doesn't prevent the
+                # program from exiting, what's left is deleted by the next
+                # execution
+                self._thread = threading.Thread(target=self._delete,
+                                                daemon=True)
+                self._thread.start()
+
+    def _delete(self):
+        while True:
+            trash_path = self._pending.get()
+            try:
+                if os.path.isdir(trash_path) and \
+                        not os.path.islink(trash_path):
+                    shutil.rmtree(trash_path, ignore_errors=True)
+                else:
+                    os.remove(trash_path)
+            except OSError:
+                pass
+            self._pending.task_done()
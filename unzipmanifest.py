@@ -0,0 +1,109 @@
+from typing import Optional
+import json
+import os
+
+
+class UnzipManifest:
+    """Records what was unzipped in a directory.
+
+    The manifest contains the digest of the archive and the size,
+    modification time and CRC32 of every file that was extracted from it. It is stored
+    in the directory itself so it disappears with the directory.
+
+    Checking a manifest only requires a stat of each file which is much
+    cheaper than unzipping the archive again. Files that were added to the
+    directory after it was unzipped, like build outputs, are ignored.
+    """
+
+    file_name = ".bootstrap-unzip.json"
+
+    def __init__(self, digest: str, files: dict):
+        """
+        Parameters
+        ----------
+        digest : str
+            The SHA-256 digest of the archive.
+        files : dict
+            The size, modification time in nanoseconds and CRC32 of each file,
+            keyed by the path of the file relative to the directory. The
+            CRC32 is None if it is unknown.
+        """
+
+        self.digest = digest
+        self.files = files
+
+    @staticmethod
+    def create(directory: str, digest: str,
+               crcs: Optional[dict] = None) -> "UnzipManifest":
+        """Creates the manifest of a directory that was just unzipped and
+        saves it in the directory.
+
+        Parameters
+        ----------
+        directory : str
+            The directory.
+        digest : str
+            The SHA-256 digest of the archive that was unzipped in it.
+        crcs : dict, optional
+            The CRC32 of the files extracted from the archive keyed by their
+            path relative to the directory. If not provided all the files in
+            the directory are recorded without their CRC32.
+        """
+        if crcs is None:
+            crcs = {}
+            for root, dirs, names in os.walk(directory):
+                for name in names:
+                    path = os.path.join(root, name)
+                    relative_path = os.path.relpath(path, directory).replace(
+                        os.sep, "/")
+                    if relative_path != UnzipManifest.file_name:
+                        crcs[relative_path] = None
+        files = {}
+        for relative_path, crc in crcs.items():
+            stat = os.lstat(os.path.join(directory, relative_path))
+            files[relative_path] = [stat.st_size, stat.st_mtime_ns, crc]
+        manifest = UnzipManifest(digest, files)
+        with open(os.path.join(directory, UnzipManifest.file_name),
+                  "w") as file:
+            file.write(json.dumps({"sha256": digest, "files": files}))
+        return manifest
+
+    @staticmethod
+    def load(directory: str) -> Optional["UnzipManifest"]:
+        try:
+            with open(os.path.join(directory, UnzipManifest.file_name),
+                      "r") as file:
+                manifest = json.loads(file.read())
+            return UnzipManifest(manifest["sha256"], manifest["files"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def matches(directory: str, digest: str) -> bool:
+        """Checks whether a directory contains the unmodified contents of an
+        archive.
+
+        Parameters
+        ----------
+        directory : str
+            The directory.
+        digest : str
+            The SHA-256 digest of the archive.
+
+        Returns
+        -------
+        bool
+            True if the archive was unzipped in the directory and none of the
+            files have been modified or deleted since.
+        """
+        manifest = UnzipManifest.load(directory)
+        if (manifest is None) or (manifest.digest != digest):
+            return False
+        for relative_path, values in manifest.files.items():
+            try:
+                stat = os.lstat(os.path.join(directory, relative_path))
+            except OSError:
+                return False
+            if (stat.st_size != values[0]) or (stat.st_mtime_ns != values[1]):
+                return False
+        return True
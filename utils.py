@@ -1,11 +1,15 @@
+import os
 import shutil
+from trash import Trash
 
 
 class Utils:
     def rmdir_with_retry(dir_path, input):
         while True:
             try:
-                shutil.rmtree(dir_path)
+                # The directory is deleted in the background so we don't
+                # have to wait for large trees to be deleted
+                Trash.shared().move(dir_path)
                 break
             except FileNotFoundError:
                 break
@@ -15,3 +19,63 @@ class Utils:
                 answer = input.query("Do you want to retry?", ["y", "n"], "y")
                 if answer == "n":
                     raise
+
+    def clone_tree(source_dir, destination_dir):
+        """Populates a directory with the same files as another directory.
+
+        The files are cloned with reflinks if the file system supports them.
+        If not they are hardlinked, and if that is not possible either they
+        are copied. Reflinks and copies are independent from the source files
+        but hardlinks share their contents with them.
+
+        Parameters
+        ----------
+        source_dir : str
+            The directory to clone.
+        destination_dir : str
+            The directory to create.
+
+        Returns
+        -------
+        str
+            The method used for the last file: "reflink", "hardlink" or
+            "copy".
+        """
+        methods = ["reflink", "hardlink", "copy"]
+
+        def clone_file(source, destination):
+            # Fall back to the next method the first time a method fails
+            # so we don't keep trying a method that isn't supported
+            while True:
+                try:
+                    if methods[0] == "reflink":
+                        _reflink(source, destination)
+                    elif methods[0] == "hardlink":
+                        os.link(source, destination)
+                    else:
+                        shutil.copy2(source, destination)
+                    return destination
+                except OSError:
+                    if len(methods) == 1:
+                        raise
+                    if os.path.lexists(destination):
+                        os.remove(destination)
+                    methods.pop(0)
+
+        shutil.copytree(source_dir, destination_dir, symlinks=True,
+                        copy_function=clone_file)
+        return methods[0]
+
+
+def _reflink(source, destination):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflinks are not supported on this platform")
+    # FICLONE ioctl, supported by Btrfs, XFS and other Linux file systems
+    ficlone = 0x40049409
+    with open(source, "rb") as source_file:
+        with open(destination, "wb") as destination_file:
+            fcntl.ioctl(destination_file.fileno(), ficlone,
+                        source_file.fileno())
+    shutil.copystat(source, destination)
@@ -0,0 +1,68 @@
+import os
+import time
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class WorkspaceLock:
+    """Inter-process lock that prevents a prefetch and a bootstrap build from
+    modifying the same workspace at the same time.
+
+    The lock is held until it is released or the process exits.
+    """
+
+    def __init__(self, path: str):
+        """
+        Parameters
+        ----------
+        path : str
+            The path of the file that is locked. It is created if it doesn't
+            exist.
+        """
+
+        self.path = path
+        self._file = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquires the lock.
+
+        Parameters
+        ----------
+        blocking : bool
+            If True waits until the lock is available, otherwise returns
+            straight away.
+
+        Returns
+        -------
+        bool
+            True if the lock was acquired, False if it is held by another
+            process and blocking is False.
+        """
+        file = open(self.path, "a+")
+        while True:
+            try:
+                if os.name == "nt":
+                    file.seek(0)
+                    msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._file = file
+                return True
+            except OSError:
+                if not blocking:
+                    file.close()
+                    return False
+                time.sleep(1)
+
+    def release(self):
+        if self._file is None:
+            return
+        if os.name == "nt":
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
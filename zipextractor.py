@@ -0,0 +1,205 @@
+from typing import Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import queue
+import shutil
+import zipfile
+import zlib
+from output import Output
+
+
+class ZipExtractor:
+    """Extracts zip archives using several threads.
+
+    zlib releases the GIL while it inflates data so the members of an archive
+    can be inflated and written on several cores at the same time. Each
+    thread uses its own ZipFile instance because ZipFile instances can't be
+    shared between threads.
+    """
+
+    # Archives with fewer members than this are extracted on the calling
+    # thread as the cost of starting the threads would outweigh the gain
+    min_parallel_members = 64
+
+    def __init__(self, jobs: int = os.cpu_count()):
+        """
+        Parameters
+        ----------
+        jobs : int
+            The maximum number of threads used to extract an archive.
+        """
+
+        self.jobs = max(1, jobs or 1)
+
+    def extract(self, archive_path: str, destination: str):
+        """Extracts all the members of an archive.
+
+        Parameters
+        ----------
+        archive_path : str
+            The path of the zip archive.
+        destination : str
+            The directory where the archive is extracted.
+        """
+        with zipfile.ZipFile(archive_path, "r") as zip_ref:
+            members = zip_ref.infolist()
+            if (self.jobs == 1) or \
+                    (len(members) < self.min_parallel_members):
+                zip_ref.extractall(destination)
+                return
+
+        # Create all the directories up front so the threads don't race to
+        # create them
+        directories = set()
+        files = []
+        for member in members:
+            path = ZipExtractor._member_path(destination, member)
+            if member.is_dir():
+                directories.add(path)
+            else:
+                directories.add(os.path.dirname(path))
+                files.append(member)
+        for directory in sorted(directories):
+            Path(directory).mkdir(parents=True, exist_ok=True)
+
+        # Start with the largest members so a large member near the end of
+        # the archive doesn't delay the completion
+        files.sort(key=lambda member: member.file_size, reverse=True)
+        pending = queue.Queue()
+        for member in files:
+            pending.put(member)
+
+        def extract_members():
+            with zipfile.ZipFile(archive_path, "r") as zip_ref:
+                while True:
+                    try:
+                        member = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    zip_ref.extract(member, destination)
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(extract_members)
+                       for i in range(min(self.jobs, len(files)))]
+            for future in futures:
+                future.result()
+
+    def update(self, archive_path: str, member_prefix: str, destination: str,
+               previous_files: Optional[dict]) -> Dict[str, int]:
+        """Updates a directory to match the contents of an archive, only
+        writing the files that changed.
+
+        A file is considered unchanged if it has the size and CRC32 recorded
+        for the member in the central directory of the archive. The CRC32 of
+        a file on disk is only computed if the file doesn't have the size and
+        modification time recorded in previous_files. Unchanged files keep
+        their modification time so the build tools don't rebuild them.
+
+        Parameters
+        ----------
+        archive_path : str
+            The path of the zip archive.
+        member_prefix : str
+            The prefix of the members to extract, usually the top-level
+            directory of the archive. It is removed from the paths of the
+            extracted files.
+        destination : str
+            The directory to update.
+        previous_files : dict, optional
+            The files previously extracted in the directory, as recorded by
+            UnzipManifest. The files that are not in the archive anymore are
+            deleted.
+
+        Returns
+        -------
+        Dict[str, int]
+            The CRC32 of every file extracted from the archive, keyed by the
+            path of the file relative to the destination.
+        """
+        if previous_files is None:
+            previous_files = {}
+        files = {}
+        written = 0
+        with zipfile.ZipFile(archive_path, "r") as zip_ref:
+            for member in zip_ref.infolist():
+                if not member.filename.startswith(member_prefix):
+                    continue
+                relative_path = member.filename[len(member_prefix):]
+                parts = [part for part in relative_path.split("/")
+                         if part not in ["", ".", ".."]]
+                if len(parts) == 0:
+                    continue
+                path = os.path.join(destination, *parts)
+                if member.is_dir():
+                    Path(path).mkdir(parents=True, exist_ok=True)
+                    continue
+                relative_path = "/".join(parts)
+                files[relative_path] = member.CRC
+                if ZipExtractor._is_unchanged(
+                        path, member, previous_files.get(relative_path)):
+                    continue
+                Path(path).parent.mkdir(parents=True, exist_ok=True)
+                # Write to a new file so that hardlinked copies of the
+                # previous file are not modified
+                temp_path = path + ".bootstrap-tmp"
+                with zip_ref.open(member) as source:
+                    with open(temp_path, "wb") as target:
+                        shutil.copyfileobj(source, target)
+                os.replace(temp_path, path)
+                written += 1
+        removed = 0
+        for relative_path in previous_files:
+            if relative_path not in files:
+                try:
+                    os.remove(os.path.join(destination, relative_path))
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+        Output.print_line("    " + destination + ": " + str(written) +
+                          " file(s) written, " + str(removed) + " removed, " +
+                          str(len(files) - written) + " unchanged")
+        return files
+
+    @staticmethod
+    def member_crcs(archive_path: str, member_prefix: str) -> Dict[str, int]:
+        """Returns the CRC32 of the files in an archive, keyed by their path
+        relative to member_prefix."""
+        crcs = {}
+        with zipfile.ZipFile(archive_path, "r") as zip_ref:
+            for member in zip_ref.infolist():
+                if member.is_dir() or \
+                        not member.filename.startswith(member_prefix):
+                    continue
+                parts = [part for part in
+                         member.filename[len(member_prefix):].split("/")
+                         if part not in ["", ".", ".."]]
+                if len(parts) != 0:
+                    crcs["/".join(parts)] = member.CRC
+        return crcs
+
+    @staticmethod
+    def _is_unchanged(path, member, previous):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        if stat.st_size != member.file_size:
+            return False
+        if (previous is not None) and (len(previous) > 2) and \
+                (previous[0] == stat.st_size) and \
+                (previous[1] == stat.st_mtime_ns) and \
+                (previous[2] == member.CRC):
+            return True
+        crc = 0
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                crc = zlib.crc32(chunk, crc)
+        return crc == member.CRC
+
+    @staticmethod
+    def _member_path(destination, member):
+        # Same sanitization of the member name as ZipFile.extract
+        parts = [part for part in member.filename.split("/")
+                 if part not in ["", ".", ".."]]
+        return os.path.join(destination, *parts)